@@ -0,0 +1,63 @@
+'''
+Compares the vectorised GradingSchema.get_feedback with the row-by-row path
+on synthetic cohorts.
+
+Usage: python benchmarks/feedback_benchmark.py [cohort sizes...]
+'''
+import numpy as np
+import pandas as pd
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from nbta.grading import GradingSchema
+
+OPTIONS = ['not_answered', 'failed', 'pass', 'high_pass', 'merit', 'high_merit',
+           'distinction', 'high_distinction', 'neg_no_comments', 'neg_no_plots',
+           'good_functions', 'good_names', 'clear_markdown', 'tested_code']
+
+
+def synthetic_schema(nb_candidates, seed=0):
+    rng = np.random.default_rng(seed)
+    markings = pd.DataFrame(rng.random((nb_candidates, len(OPTIONS))) > 0.5, columns=OPTIONS)
+    markings['not_answered'] = rng.random(nb_candidates) > 0.95
+    markings['additional_comments'] = rng.choice(['', ' ', 'well done', 'see the notes on Q2'], nb_candidates)
+    markings.insert(0, 'candidate', [f'candidate_{i}' for i in range(nb_candidates)])
+
+    schema = GradingSchema('question_1', 20)
+    schema.markings = markings
+    return schema
+
+
+def write_options():
+    os.makedirs('grading/testing/notebook_tests', exist_ok=True)
+    options = pd.DataFrame({'options': OPTIONS + ['additional_comments'],
+                            'feedback': [f'feedback for {o}' for o in OPTIONS] + ['comments']})
+    options.to_csv('grading/testing/notebook_tests/question_1.csv', index=False)
+
+
+def time_feedback(schema, vectorized):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        feedbacks = schema.get_feedback(vectorized=vectorized)
+    return time.perf_counter() - start, feedbacks
+
+
+def main(sizes):
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        write_options()
+        print(f'{"candidates":>10} {"row-by-row (s)":>15} {"vectorised (s)":>15} {"speed-up":>9}')
+        for size in sizes:
+            schema = synthetic_schema(size)
+            slow, expected = time_feedback(schema, vectorized=False)
+            fast, feedbacks = time_feedback(schema, vectorized=True)
+            if not feedbacks.equals(expected):
+                raise AssertionError(f'Feedback differs between the two paths for {size} candidates')
+            print(f'{size:>10} {slow:>15.3f} {fast:>15.3f} {slow / fast:>8.0f}x')
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or [100, 1000, 10000])
@@ -0,0 +1,66 @@
+'''
+Compares the single-scan tag lookup of ParsedNotebook.insert_cells with one
+substring search per tag, on synthetic notebooks held in memory.
+
+Usage: python benchmarks/insert_benchmark.py [number of notebooks...]
+'''
+import nbformat as nbf
+import numpy as np
+import sys
+import time
+from nbta.notebooks import ParsedNotebook, TagIndex
+
+
+class SyntheticCell():
+    def __init__(self, name, tag, position):
+        self.name = name
+        self.tag = tag
+        self.position = position
+        self.cell = nbf.v4.new_code_cell(source=f"nbta_test_{name} = QuestionGrader('{name}')")
+
+
+class NaiveIndex(TagIndex):
+    def matches(self, source):
+        return [new_cell for new_cell in self.new_cells if new_cell.tag in source]
+
+
+def synthetic_notebook(author, nb_cells=120, seed=0):
+    rng = np.random.default_rng(seed)
+    notebook = ParsedNotebook.__new__(ParsedNotebook)
+    notebook.author = author
+    notebook.modified_content = None
+    notebook.content = nbf.v4.new_notebook()
+    filler = 'x = np.linspace(0, 1, 100)  # some student code\n' * 40
+    cells = []
+    for index in range(nb_cells):
+        if index % 6 == 0:
+            cells.append(nbf.v4.new_markdown_cell(f'## Question {index // 6 + 1}\n{filler}'))
+        else:
+            cells.append(nbf.v4.new_code_cell(filler[:rng.integers(100, len(filler))]))
+    notebook.content['cells'] = cells
+    return notebook
+
+
+def time_insert(notebooks, new_cells, tag_index):
+    start = time.perf_counter()
+    sources = [[cell['source'] for cell in notebook.insert_cells(new_cells, tag_index).modified_content['cells']]
+               for notebook in notebooks]
+    return time.perf_counter() - start, sources
+
+
+def main(sizes, nb_questions=20):
+    new_cells = [SyntheticCell(f'Q{i}', f'## Question {i}\n', 'before' if i % 3 else 'after')
+                 for i in range(1, nb_questions + 1)]
+    print(f'{"notebooks":>10} {"per tag (s)":>12} {"one scan (s)":>13} {"speed-up":>9}')
+    for size in sizes:
+        notebooks = [synthetic_notebook(f'candidate_{i}', seed=i) for i in range(size)]
+        slow, expected = time_insert(notebooks, new_cells, NaiveIndex(new_cells))
+        fast, sources = time_insert(notebooks, new_cells, TagIndex(new_cells))
+        # headers hold the generation time, so only compare from the first student cell on
+        if [s[2:] for s in sources] != [s[2:] for s in expected]:
+            raise AssertionError(f'Marking notebooks differ between the two lookups for {size} notebooks')
+        print(f'{size:>10} {slow:>12.3f} {fast:>13.3f} {slow / fast:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or [100, 1000])
@@ -0,0 +1,35 @@
+import importlib
+import sys
+import time
+
+loaded_tests = {}
+
+
+def load_test(the_test, test_paths):
+    '''
+    Imports the module holding the test class the_test once per process and
+    returns the class.
+    '''
+    if the_test not in loaded_tests:
+        for test_path in reversed(test_paths):
+            if test_path not in sys.path:
+                sys.path.insert(0, test_path)
+        mod = importlib.import_module(the_test)
+        loaded_tests[the_test] = getattr(mod, the_test)
+    return loaded_tests[the_test]
+
+
+def run_test(the_test, test_paths, folder, candidate):
+    '''
+    Runs the external test the_test on one candidate folder. Failures are
+    returned instead of raised so the other candidates keep running.
+    '''
+    start = time.perf_counter()
+    result = None
+    error = None
+    try:
+        tester = load_test(the_test, test_paths)
+        result = tester(folder=folder).run_test()
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+    return candidate, result, error, time.perf_counter() - start
@@ -0,0 +1,113 @@
+import nbformat as nbf
+import hashlib
+import json
+import os
+
+CACHED_STATUSES = ['ok', 'error']
+
+
+def hash_file(path, hasher, chunk_size=1024 * 1024):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher
+
+
+class ExecutionCache():
+    '''
+    Usage: ExecutionCache(folder='grading/cache')
+
+    On-disk cache of executed marking notebooks. Entries are keyed by the code
+    cells of the marking notebook, the kernel name, the content of the data
+    files in the candidate folder and the test modules and options (*.py and
+    *.csv) under testing_dir, which the marking cells import. A candidate is
+    only executed again when one of those changes. Only runs with status ok or
+    error are cached.
+    '''
+
+    def __init__(self, folder='grading/cache', testing_dir='grading/testing'):
+        self.folder = os.path.abspath(folder)
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder, exist_ok=True)
+        # hashed once, the tests do not change during a run
+        self.testing_digest = self.hash_testing_files(testing_dir)
+
+    def hash_testing_files(self, testing_dir):
+        hasher = hashlib.sha256()
+        if not os.path.isdir(testing_dir):
+            return hasher.hexdigest()
+        for root, dirs, file_names in os.walk(testing_dir):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.') and d != '__pycache__')
+            for file_name in sorted(file_names):
+                if file_name.endswith('.py') or file_name.endswith('.csv'):
+                    path = os.path.join(root, file_name)
+                    hasher.update(f'\x00file\x00{os.path.relpath(path, testing_dir)}\x00'.encode())
+                    hash_file(path, hasher)
+        return hasher.hexdigest()
+
+    def key(self, nb, kernel, candidate_dir, notebook_name):
+        hasher = hashlib.sha256()
+        hasher.update(f'kernel:{kernel}\n'.encode())
+        hasher.update(f'tests:{self.testing_digest}\n'.encode())
+        for cell in nb['cells']:
+            if cell['cell_type'] == 'code':
+                hasher.update(b'\x00cell\x00')
+                hasher.update(cell['source'].encode())
+        for rel_path in self.data_files(candidate_dir, notebook_name):
+            hasher.update(f'\x00file\x00{rel_path}\x00'.encode())
+            hash_file(f'{candidate_dir}/{rel_path}', hasher)
+        return hasher.hexdigest()
+
+    def data_files(self, candidate_dir, notebook_name):
+        skipped_files = [f'{notebook_name}.ipynb', f'{notebook_name}_marking.ipynb']
+        files = []
+        for root, dirs, file_names in os.walk(candidate_dir):
+            dirs[:] = [d for d in dirs if d not in ['grades', '.ipynb_checkpoints']
+                       and not d.startswith('.') and not d.startswith('nbta_')]
+            for file_name in file_names:
+                if file_name.startswith('.') or file_name.startswith('nbta_') or file_name in skipped_files:
+                    continue
+                files.append(os.path.relpath(os.path.join(root, file_name), candidate_dir))
+        files.sort()
+        return files
+
+    def get(self, key):
+        notebook_path = f'{self.folder}/{key}.ipynb'
+        summary_path = f'{self.folder}/{key}.json'
+        if not (os.path.exists(notebook_path) and os.path.exists(summary_path)):
+            return None
+        try:
+            with open(summary_path, 'r') as f:
+                summary = json.load(f)
+            with open(notebook_path, 'r', encoding='utf-8') as f:
+                executed = nbf.read(f, as_version=nbf.NO_CONVERT)
+        except Exception:
+            return None
+        return executed, summary['status'], summary['message']
+
+    def put(self, key, nb, status, auth_errors):
+        if status not in CACHED_STATUSES:
+            return None
+        self.atomic_write(f'{self.folder}/{key}.ipynb', nbf.writes(nb))
+        self.atomic_write(f'{self.folder}/{key}.json', json.dumps({'status': status, 'message': auth_errors}))
+        return None
+
+    def atomic_write(self, path, text):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def restore(self, nb, executed):
+        '''
+        Copies the outputs of a cached execution into nb. Markdown cells of nb
+        are kept as they are, so the freshly generated header is preserved.
+        '''
+        cached_cells = [cell for cell in executed['cells'] if cell['cell_type'] == 'code']
+        code_cells = [cell for cell in nb['cells'] if cell['cell_type'] == 'code']
+        for cell, cached_cell in zip(code_cells, cached_cells):
+            cell['outputs'] = cached_cell.get('outputs', [])
+            cell['execution_count'] = cached_cell.get('execution_count')
+        if 'language_info' in executed['metadata']:
+            nb['metadata']['language_info'] = executed['metadata']['language_info']
+        return nb
@@ -0,0 +1,110 @@
+import argparse
+from datetime import datetime
+from nbta.notebooks import NotebookMarker
+from nbta.jobs import RunQueue
+from nbta.shards import merge_shards, queue_path, queue_summary
+from nbta.compaction import OutputCompactor
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='nbta-run',
+                                     description='Queue and execute the marking notebooks of a cohort.')
+    parser.add_argument('--folder', default='notebooks', help='folder holding one sub-folder per candidate')
+    parser.add_argument('--notebook', help='name of the notebook to mark, without .ipynb')
+    parser.add_argument('--queue', default=None,
+                        help='path of the run queue (default: nbta_queue_<notebook>.sqlite in the scores folder of the shard)')
+    parser.add_argument('--shard', help="only handle shard i of N (written 'i/N', from 1/N to N/N)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = commands.add_parser('enqueue', help='add candidates to the queue')
+    enqueue.add_argument('candidates', nargs='*', help='candidates to add (default: every candidate)')
+    enqueue.add_argument('--priority', type=int, default=0)
+    enqueue.add_argument('--reset', action='store_true', help='queue again candidates that already ran')
+    enqueue.add_argument('--late-after', help='deadline (ISO format); late submissions get --late-priority')
+    enqueue.add_argument('--late-priority', type=int, default=5)
+
+    requeue = commands.add_parser('requeue', help='put failed jobs back in the queue')
+    requeue.add_argument('--state', action='append', default=None, choices=['failed', 'done', 'running'])
+    requeue.add_argument('--priority', type=int, default=10)
+
+    work = commands.add_parser('work', help='execute pending jobs')
+    work.add_argument('--workers', type=int, default=1)
+    work.add_argument('--limit', type=int, default=None, help='stop after this many candidates')
+    work.add_argument('--kernel', default='python3')
+    work.add_argument('--cell-timeout', type=int, default=None, help='seconds')
+    work.add_argument('--notebook-timeout', type=int, default=None, help='seconds')
+    work.add_argument('--memory-limit', type=int, default=None, help='MB per kernel')
+    work.add_argument('--cache', action='store_true', help='reuse executions of unchanged notebooks')
+    work.add_argument('--warm-kernels', action='store_true', help='reuse one kernel per worker between candidates')
+    work.add_argument('--max-uses', type=int, default=50, help='candidates per warm kernel before a restart')
+    work.add_argument('--max-output-chars', type=int, default=None, help='truncate longer text outputs')
+    work.add_argument('--image-width', type=int, default=None, help='downscale wider images (pixels)')
+    work.add_argument('--image-folder', default=None, help='move images to this folder of each candidate')
+    work.add_argument('--recover', action='store_true',
+                      help='requeue jobs left running by a session of this machine that died, or running for '
+                           'longer than --recover-after')
+    work.add_argument('--recover-after', type=int, default=3600, help='seconds (default: 3600)')
+
+    autotests = commands.add_parser('autotests', help='run the external tests of grading/testing')
+    autotests.add_argument('--workers', type=int, default=1)
+
+    profile = commands.add_parser('profile', help='show the slowest cells and candidates of the last runs')
+    profile.add_argument('--top', type=int, default=10)
+
+    commands.add_parser('merge', help='combine the outputs of every shard into grading/scores')
+    commands.add_parser('status', help='show the state of the queue (of every notebook and shard without --queue)')
+    return parser
+
+
+def marker(args):
+    if args.notebook is None:
+        raise SystemExit('nbta-run: --notebook is required for this command')
+    return NotebookMarker(args.folder, args.notebook, lazy=True, shard=args.shard)
+
+
+def compactor(args):
+    if args.max_output_chars is None and args.image_width is None and args.image_folder is None:
+        return None
+    return OutputCompactor(args.max_output_chars, args.image_width, args.image_folder)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command in ['merge', 'status'] and args.queue is None:
+        if args.command == 'merge':
+            merge_shards()
+        summary = queue_summary()
+        print(summary.to_string() if summary.shape[1] > 0 else 'No run queue found')
+        return 0
+    if args.queue is None and args.notebook is None:
+        raise SystemExit('nbta-run: --notebook (or --queue) is required for this command')
+    queue = RunQueue(args.queue if args.queue is not None else queue_path(args.shard, args.notebook))
+
+    if args.command == 'enqueue':
+        the_marker = marker(args)
+        candidates = args.candidates or list(the_marker.candidates)
+        queue.enqueue(candidates, args.priority, args.reset)
+        if args.late_after is not None:
+            late = [c for c in the_marker.late_candidates(datetime.fromisoformat(args.late_after)) if c in candidates]
+            queue.enqueue(late, args.late_priority, reset=True)
+            print(f'{len(late)} late submission(s) queued with priority {args.late_priority}')
+    elif args.command == 'requeue':
+        queue.requeue(args.state or ['failed'], args.priority)
+    elif args.command == 'work':
+        the_marker = marker(args)
+        if args.recover:
+            queue.recover(args.recover_after, set(the_marker.notebooks))
+        the_marker.run_queue(queue, limit=args.limit, workers=args.workers, kernel=args.kernel,
+                             cell_timeout=args.cell_timeout, notebook_timeout=args.notebook_timeout,
+                             memory_limit=args.memory_limit, cache=args.cache,
+                             warm_kernels=args.warm_kernels, max_uses=args.max_uses, compactor=compactor(args))
+    elif args.command == 'autotests':
+        marker(args).run_autotests(workers=args.workers)
+    elif args.command == 'profile':
+        marker(args).profile_report(top=args.top)
+        return 0
+    elif args.command == 'merge':
+        merge_shards()
+
+    print(queue.summary().to_string())
+    return 0
@@ -0,0 +1,122 @@
+import nbformat as nbf
+import base64
+import hashlib
+import io
+import os
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+IMAGE_TYPES = {'image/png': 'png', 'image/jpeg': 'jpg'}
+
+
+def truncate_text(text, max_chars):
+    if max_chars is None or len(text) <= max_chars:
+        return text
+    head = text[:max_chars // 2]
+    tail = text[len(text) - max_chars // 2:]
+    return f'{head}\n... [nbta: {len(text) - len(head) - len(tail)} characters removed] ...\n{tail}'
+
+
+class OutputCompactor():
+    '''
+    Usage: OutputCompactor(max_chars=20000, image_width=800, image_folder='nbta_outputs')
+
+    Shrinks the outputs of an executed marking notebook before it is written,
+    so that markers can open it quickly:
+    - text outputs longer than max_chars keep their beginning and end only,
+      and oversized HTML (typically a huge DataFrame) is dropped when a plain
+      text version exists
+    - images wider than image_width pixels are downscaled (needs Pillow)
+    - with image_folder, images are written to that folder of the candidate
+      and the notebook links to them; identical images are stored once
+    - with deduplicate, runs of identical outputs in a cell are kept once
+    None disables a limit. Error outputs are never changed.
+    '''
+
+    def __init__(self, max_chars=20000, image_width=None, image_folder=None, deduplicate=True):
+        self.max_chars = max_chars
+        self.image_width = image_width
+        self.image_folder = image_folder
+        self.deduplicate = deduplicate
+
+    def compact(self, nb, candidate_dir):
+        for cell in nb['cells']:
+            if cell['cell_type'] != 'code' or len(cell.get('outputs', [])) == 0:
+                continue
+            outputs = self.deduplicate_outputs(cell['outputs']) if self.deduplicate else cell['outputs']
+            for output in outputs:
+                self.compact_output(output, candidate_dir)
+            cell['outputs'] = outputs
+        return nb
+
+    def deduplicate_outputs(self, outputs):
+        kept = []
+        repeats = 0
+        for output in outputs:
+            if len(kept) > 0 and output == kept[-1]:
+                repeats += 1
+                continue
+            if repeats > 0:
+                kept.append(self.repeat_note(repeats))
+                repeats = 0
+            kept.append(output)
+        if repeats > 0:
+            kept.append(self.repeat_note(repeats))
+        return kept
+
+    def repeat_note(self, repeats):
+        return nbf.NotebookNode({'output_type': 'stream', 'name': 'stdout',
+                                 'text': f'[nbta: the output above was repeated {repeats} more time(s)]\n'})
+
+    def compact_output(self, output, candidate_dir):
+        if output['output_type'] == 'stream':
+            output['text'] = truncate_text(output['text'], self.max_chars)
+            return output
+        if output['output_type'] not in ['display_data', 'execute_result']:
+            return output
+
+        data = output['data']
+        if self.max_chars is not None and 'text/html' in data and 'text/plain' in data \
+                and len(data['text/html']) > self.max_chars:
+            del data['text/html']
+        for mime_type in ['text/plain', 'text/html', 'text/markdown']:
+            if mime_type in data:
+                data[mime_type] = truncate_text(data[mime_type], self.max_chars)
+
+        for mime_type, extension in IMAGE_TYPES.items():
+            if mime_type not in data:
+                continue
+            image = base64.b64decode(data[mime_type])
+            image = self.downscale(image, extension)
+            if self.image_folder is None:
+                data[mime_type] = base64.b64encode(image).decode('ascii')
+            else:
+                link = self.save_image(image, extension, candidate_dir)
+                del data[mime_type]
+                data['text/html'] = f'<img src="{link}"/>'
+                output.get('metadata', {}).pop(mime_type, None)
+        return output
+
+    def downscale(self, image, extension):
+        if self.image_width is None or Image is None:
+            return image
+        picture = Image.open(io.BytesIO(image))
+        if picture.width <= self.image_width:
+            return image
+        height = max(1, round(picture.height * self.image_width / picture.width))
+        picture = picture.resize((self.image_width, height), Image.LANCZOS)
+        buffer = io.BytesIO()
+        picture.save(buffer, format='PNG' if extension == 'png' else 'JPEG')
+        return buffer.getvalue()
+
+    def save_image(self, image, extension, candidate_dir):
+        folder = f'{candidate_dir}/{self.image_folder}'
+        os.makedirs(folder, exist_ok=True)
+        file_name = f'{hashlib.sha256(image).hexdigest()[:16]}.{extension}'
+        if not os.path.exists(f'{folder}/{file_name}'):
+            with open(f'{folder}/{file_name}', 'wb') as f:
+                f.write(image)
+        return f'{self.image_folder}/{file_name}'
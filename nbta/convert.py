@@ -1,56 +1,149 @@
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+import pandas as pd
 import json
+import os
+import time
 from os import listdir
 from os.path import isfile, join
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+
+CELL_CLASSES = ['text_cell_render', 'input_area']
+MANIFEST_COLUMNS = ['source', 'output', 'code_cells', 'markdown_cells', 'bytes', 'duration', 'error']
+
+
+def is_cell_div(classes):
+    # the parser may hand over the class attribute as a string or a list
+    if classes is None:
+        return False
+    if isinstance(classes, str):
+        classes = classes.split()
+    return any(clas in CELL_CLASSES for clas in classes)
+
+
+def html_to_notebook(text):
+    '''
+    Rebuilds the cells of a notebook from its HTML export. Only the
+    text_cell_render (markdown) and input_area (code) divs are parsed; the
+    rest of the page is skipped by the parser.
+    '''
+    soup = BeautifulSoup(text, 'lxml', parse_only=SoupStrainer('div', class_=is_cell_div))
+    dictionary = {'nbformat': 4, 'nbformat_minor': 1, 'cells': [], 'metadata': {}}
+    for d in soup.find_all('div', class_=is_cell_div):
+        for clas in d.attrs['class']:
+            # code cell
+            if clas == 'input_area':
+                dictionary['cells'].append({'metadata': {}, 'outputs': [], 'source': [d.get_text()],
+                                            'execution_count': None, 'cell_type': 'code'})
+            elif clas == 'text_cell_render':
+                dictionary['cells'].append({'metadata': {}, 'source': [d.decode_contents()],
+                                            'cell_type': 'markdown'})
+    return dictionary
+
+
+def convert_html_file(source, output):
+    '''
+    Converts the HTML export at source into the notebook at output and
+    returns its manifest record. Errors are recorded instead of raised.
+    '''
+    start = time.perf_counter()
+    record = {'source': source, 'output': output, 'code_cells': 0, 'markdown_cells': 0,
+              'bytes': 0, 'duration': None, 'error': None}
+    try:
+        with open(source, 'r', encoding='utf-8') as f:
+            dictionary = html_to_notebook(f.read())
+        text = json.dumps(dictionary)
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        cell_types = [cell['cell_type'] for cell in dictionary['cells']]
+        record.update(code_cells=cell_types.count('code'), markdown_cells=cell_types.count('markdown'),
+                      bytes=len(text.encode('utf-8')))
+    except Exception as e:
+        record['error'] = f'{type(e).__name__}: {e}'
+    record['duration'] = time.perf_counter() - start
+    return record
+
 
 class htmlToIpnb:
-    def __init__(self,folder='../raw_data/htmls'):
+    '''
+    Usage: htmlToIpnb(folder='../raw_data/htmls').convert(workers=4)
+
+    Converts the HTML exports of notebooks in folder back to .ipynb files.
+    Every batch updates a manifest (nbta_manifest.csv in folder by default)
+    with the source, output, cell counts, size, duration and error of each
+    file, and later batches only convert the files that are missing from it,
+    failed, or changed since.
+    '''
+
+    def __init__(self,folder='../raw_data/htmls', manifest=None):
         self.folder=folder
-        
+        self.manifest_path = manifest if manifest is not None else f'{folder}/nbta_manifest.csv'
+
+    def output_name(self, file_name):
+        return f"{self.folder}/{os.path.splitext(file_name)[0]}.ipynb"
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return pd.DataFrame(columns=MANIFEST_COLUMNS)
+        return pd.read_csv(self.manifest_path)
+
+    def needs_conversion(self, file_name, manifest):
+        source = f'{self.folder}/{file_name}'
+        output = self.output_name(file_name)
+        if source not in manifest.index or pd.notna(manifest.loc[source, 'error']):
+            return True
+        return not os.path.exists(output) or os.path.getmtime(output) < os.path.getmtime(source)
+
     def convert_file(self, file_name):
-        response = open(f"{self.folder}/{file_name}")
-        text = response.read()
-
-        soup = BeautifulSoup(text, 'lxml')
-        dictionary = {'nbformat': 4, 'nbformat_minor': 1, 'cells': [], 'metadata': {}}
-        for d in soup.findAll("div"):
-            if 'class' in d.attrs.keys():
-                for clas in d.attrs["class"]:
-                    if clas in ["text_cell_render", "input_area"]:
-                    # code cell
-                        if clas == "input_area":
-                            cell = {}
-                            cell['metadata'] = {}
-                            cell['outputs'] = []
-                            cell['source'] = [d.get_text()]
-                            cell['execution_count'] = None
-                            cell['cell_type'] = 'code'
-                            dictionary['cells'].append(cell)
-
-                        else:
-                            cell = {}
-                            cell['metadata'] = {}
-
-                            cell['source'] = [d.decode_contents()]
-                            cell['cell_type'] = 'markdown'
-                            dictionary['cells'].append(cell)
-        notebook_name=f"{self.folder}/{file_name.strip('.html')}.ipynb"
-        
-        open(notebook_name, 'w').write(json.dumps(dictionary))
-        print(f'Notebook {notebook_name} succesfully created')
-        
-        return None
-    
-    
-    def convert(self):
+        record = convert_html_file(f'{self.folder}/{file_name}', self.output_name(file_name))
+        if record['error'] is None:
+            print(f"Notebook {record['output']} succesfully created")
+        else:
+            print(f"Error on file {file_name}:{record['error']}")
+
+        return record
+
+    def convert_batch(self, workers=1, force=False):
+        '''
+        Converts the HTML files that are not converted yet (or every file with
+        force), in a process pool when workers > 1, writes the manifest once
+        and returns it.
+        '''
         htmls = [f for f in listdir(self.folder) if f.split('.')[-1]=='html']
-        for html in htmls:
-            self.convert_file(html)
-        
-        print(f'Converted {len(htmls)} files.')
-        
+        manifest = self.load_manifest().drop_duplicates(subset='source', keep='last').set_index('source', drop=False)
+        to_convert = [html for html in htmls if force or self.needs_conversion(html, manifest)]
+        records = []
+
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(convert_html_file, f'{self.folder}/{html}', self.output_name(html))
+                           for html in to_convert]
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    records.append(future.result())
+        else:
+            for html in tqdm(to_convert):
+                records.append(convert_html_file(f'{self.folder}/{html}', self.output_name(html)))
+
+        converted = pd.DataFrame(data=records, columns=MANIFEST_COLUMNS)
+        kept = manifest[~manifest.source.isin(converted.source)]
+        self.manifest = pd.concat([kept, converted], ignore_index=True).sort_values('source').reset_index(drop=True)
+        self.manifest.to_csv(self.manifest_path, index=False)
+        self.last_batch = converted
+        return self.manifest
+
+    def convert(self, workers=1, force=False):
+        '''
+        Converts every HTML file of the folder that is not up to date (see
+        convert_batch) and prints a summary.
+        '''
+        self.convert_batch(workers, force)
+        failed = self.last_batch[self.last_batch.error.notna()]
+        for source, error in failed[['source', 'error']].values:
+            print(f'Error on file {source}:{error}')
+        print(f'Converted {self.last_batch.shape[0] - failed.shape[0]} files, {failed.shape[0]} failed, '
+              f'{self.manifest.shape[0] - self.last_batch.shape[0]} already up to date. See {self.manifest_path}')
+
         return None
 
 if __name__ == '__main__':
     htmlToIpnb().convert()
-        
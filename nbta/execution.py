@@ -0,0 +1,419 @@
+import nbformat as nbf
+from nbconvert.preprocessors import ExecutePreprocessor
+from nbconvert.preprocessors import CellExecutionError
+from nbclient.exceptions import CellTimeoutError, DeadKernelError
+from nbclient.util import run_sync
+from functools import partial
+import copy
+from multiprocessing.util import Finalize
+import os
+import shutil
+import time
+
+RUN_STATUSES = ['ok', 'error', 'timeout', 'oom', 'kernel_error']
+
+
+def limit_memory(memory_limit):
+    import resource
+    limit = int(memory_limit * 1024 * 1024)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+# run once when a warm kernel starts: the imports of utils.header_code_cell,
+# then a snapshot of the state every candidate should start from
+WARM_UP_CODE = '''
+import sys
+for _nbta_module in ['numpy', 'pandas', 'matplotlib.pyplot', 'nbta.grading']:
+    try:
+        __import__(_nbta_module)
+    except ImportError:
+        pass
+_nbta_rc = dict(sys.modules['matplotlib'].rcParams) if 'matplotlib' in sys.modules else None
+sys._nbta_warm = (set(sys.modules), list(sys.path), _nbta_rc)
+def _nbta_peak_memory():
+    # peak resident memory (kB) since the last reset, None where it cannot be reset
+    if not __import__('sys')._nbta_peak_reset:
+        return None
+    with open('/proc/self/status') as f:
+        return int([line for line in f if line.startswith('VmHWM')][0].split()[1])
+sys._nbta_peak_memory = _nbta_peak_memory
+def _nbta_reset_peak():
+    sys = __import__('sys')
+    __import__('gc').collect()
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        sys._nbta_peak_reset = True
+    except OSError:
+        sys._nbta_peak_reset = False
+sys._nbta_reset_peak = _nbta_reset_peak
+'''
+
+# run before every candidate on a warm kernel
+RESET_CODE = '''
+import os, sys
+for _nbta_module in set(sys.modules) - sys._nbta_warm[0]:
+    del sys.modules[_nbta_module]
+sys.path[:] = sys._nbta_warm[1]
+if sys._nbta_warm[2] is not None:
+    sys.modules['matplotlib.pyplot'].close('all')
+    sys.modules['matplotlib'].rcParams.update(sys._nbta_warm[2])
+os.chdir({path!r})
+get_ipython().run_line_magic('reset', '-f')
+get_ipython().execution_count = 1
+# once the previous candidate's objects are gone, restart the peak memory count
+__import__('sys')._nbta_reset_peak()
+'''
+
+warm_preprocessors = {}
+
+PEAK_MEMORY_EXPRESSION = "__import__('resource').getrusage(__import__('resource').RUSAGE_SELF).ru_maxrss"
+# ru_maxrss covers the whole life of the process, warm kernels reset the Linux peak (VmHWM) instead
+WARM_PEAK_MEMORY_EXPRESSION = "__import__('sys')._nbta_peak_memory()"
+
+
+def cell_role(cell):
+    '''
+    'grader' for the cells inserted by nbta (see ParsedNotebook.insert_cells)
+    and 'student' for everything else.
+    '''
+    return cell.get('metadata', {}).get('nbta', {}).get('role', 'student')
+
+
+def cell_name(cell):
+    name = cell.get('metadata', {}).get('nbta', {}).get('name')
+    if name is not None:
+        return name
+    lines = cell['source'].strip().split('\n')
+    return lines[0][:60]
+
+
+class MarkingPreprocessor(ExecutePreprocessor):
+    '''
+    Usage: MarkingPreprocessor(cell_timeout=60, notebook_timeout=900, memory_limit=4096)
+
+    ExecutePreprocessor with a wall-clock budget per cell and per notebook (in
+    seconds) and an optional address space cap for the kernel (in MB). A kernel
+    that goes over budget is killed; the next notebook starts a fresh one.
+
+    After each notebook, profile holds the kernel start-up time, the wall time
+    of every code cell and the peak memory of the kernel (in MB).
+    '''
+    peak_memory_expression = PEAK_MEMORY_EXPRESSION
+
+    def __init__(self, cell_timeout=None, notebook_timeout=None, memory_limit=None, **kwargs):
+        super().__init__(timeout=cell_timeout, shutdown_kernel='immediate', **kwargs)
+        self.cell_timeout = cell_timeout
+        self.notebook_timeout = notebook_timeout
+        self.memory_limit = memory_limit
+        self.deadline = None
+        self.profile = None
+        if notebook_timeout is not None:
+            self.timeout_func = self.remaining_time
+
+    def remaining_time(self, cell):
+        remaining = max(1, int(self.deadline - time.monotonic()))
+        if self.cell_timeout is not None:
+            return min(self.cell_timeout, remaining)
+        return remaining
+
+    def start_new_kernel(self, **kwargs):
+        if self.memory_limit is not None:
+            kwargs.setdefault('preexec_fn', partial(limit_memory, self.memory_limit))
+        return super().start_new_kernel(**kwargs)
+
+    def preprocess(self, nb, resources=None, km=None):
+        self.started = time.monotonic()
+        self.profile = {'kernel_startup': None, 'duration': None, 'peak_memory': None, 'cells': []}
+        if self.notebook_timeout is not None:
+            self.deadline = self.started + self.notebook_timeout
+        try:
+            return super().preprocess(nb, resources, km)
+        finally:
+            self.profile['duration'] = time.monotonic() - self.started
+
+    def preprocess_cell(self, cell, resources, index):
+        start = time.monotonic()
+        if self.profile['kernel_startup'] is None:
+            self.profile['kernel_startup'] = start - self.started
+        try:
+            result = super().preprocess_cell(cell, resources, index)
+        finally:
+            if cell['cell_type'] == 'code':
+                self.profile['cells'].append({'index': index, 'role': cell_role(cell), 'name': cell_name(cell),
+                                              'duration': time.monotonic() - start})
+        if index == len(self.nb['cells']) - 1:
+            self.profile['peak_memory'] = self.kernel_peak_memory()
+        return result
+
+    def kernel_peak_memory(self):
+        '''
+        Peak resident memory of the kernel in MB, asked to the kernel itself
+        once the last cell has run. None for kernels other than ipykernel.
+        '''
+        try:
+            msg_id = self.kc.execute('', silent=True, store_history=False,
+                                     user_expressions={'peak': self.peak_memory_expression})
+            reply = self.wait_for_reply(msg_id)
+            return int(reply['content']['user_expressions']['peak']['data']['text/plain']) / 1024
+        except Exception:
+            return None
+
+    def run_silently(self, code):
+        msg_id = self.kc.execute(code, silent=True, store_history=False)
+        reply = self.wait_for_reply(msg_id)
+        if reply is None or reply['content']['status'] != 'ok':
+            error = reply['content'].get('evalue', '') if reply is not None else 'no reply'
+            raise RuntimeError(f'Unable to prepare the kernel: {error}')
+
+    def close(self):
+        return None
+
+
+class WarmPreprocessor(MarkingPreprocessor):
+    '''
+    Usage: WarmPreprocessor(max_uses=50, cell_timeout=60)
+
+    MarkingPreprocessor that keeps its kernel from one notebook to the next.
+    The kernel imports numpy, pandas, matplotlib and nbta.grading once when it
+    starts. Before each notebook, the namespace is reset, the modules and
+    sys.path entries added by the previous candidate are dropped, matplotlib
+    settings are restored and the working directory moves to the candidate
+    folder. The kernel is replaced after max_uses notebooks and whenever a
+    notebook times out or kills it. Execution counts restart at 1 for every
+    notebook. The peak memory of a notebook is measured from its start by
+    resetting the kernel's peak resident memory (Linux only, None elsewhere).
+    '''
+    peak_memory_expression = WARM_PEAK_MEMORY_EXPRESSION
+
+    def __init__(self, max_uses=50, **kwargs):
+        super().__init__(**kwargs)
+        self.max_uses = max_uses
+        self.warm_km = None
+        self.uses = 0
+        self.fresh = False
+        # worker processes exit without running atexit handlers
+        Finalize(self, self.close, exitpriority=10)
+
+    def preprocess(self, nb, resources=None, km=None):
+        if self.warm_km is not None and self.uses >= self.max_uses:
+            self.close()
+        if self.warm_km is None:
+            self.warm_km = self.kernel_manager_class(kernel_name=self.kernel_name, config=self.config)
+            self.fresh = True
+            self.uses = 0
+        self.uses += 1
+        try:
+            return super().preprocess(nb, resources, self.warm_km)
+        except Exception:
+            self.close()
+            raise
+        finally:
+            if self.kc is not None:
+                self.kc.stop_channels()
+                self.kc = None
+
+    def preprocess_cell(self, cell, resources, index):
+        if index == 0:
+            if self.fresh:
+                self.run_silently(WARM_UP_CODE)
+                self.fresh = False
+            self.run_silently(RESET_CODE.format(path=resources['metadata']['path']))
+        return super().preprocess_cell(cell, resources, index)
+
+    def close(self):
+        if self.warm_km is None:
+            return None
+        try:
+            if run_sync(self.warm_km.is_alive)():
+                run_sync(self.warm_km.shutdown_kernel)(now=True)
+            run_sync(self.warm_km.cleanup_resources)()
+        except Exception:
+            pass
+        self.warm_km = None
+        return None
+
+
+class ExecutionSettings():
+    '''
+    Usage: ExecutionSettings(kernel='python3', cell_timeout=60)
+
+    Everything a worker process needs to execute a candidate's marking notebook.
+    Timeouts are in seconds and memory_limit in MB; None disables the limit.
+    cache is an optional nbta.cache.ExecutionCache. With warm_kernels, each
+    process reuses one kernel for up to max_uses candidates. compactor is an
+    optional nbta.compaction.OutputCompactor.
+    '''
+
+    def __init__(self, kernel='python3', save_originals=None, cell_timeout=None,
+                 notebook_timeout=None, memory_limit=None, cache=None, warm_kernels=False, max_uses=50,
+                 compactor=None):
+        self.kernel = kernel
+        self.save_originals = save_originals
+        self.cell_timeout = cell_timeout
+        self.notebook_timeout = notebook_timeout
+        self.memory_limit = memory_limit
+        self.cache = cache
+        self.warm_kernels = warm_kernels
+        self.max_uses = max_uses
+        self.compactor = compactor
+
+    def preprocessor(self):
+        kwargs = dict(cell_timeout=self.cell_timeout, notebook_timeout=self.notebook_timeout,
+                      memory_limit=self.memory_limit, kernel_name=self.kernel, allow_errors=True)
+        if self.warm_kernels:
+            return WarmPreprocessor(max_uses=self.max_uses, **kwargs)
+        return MarkingPreprocessor(**kwargs)
+
+    def worker_preprocessor(self):
+        '''
+        Preprocessor for one candidate in a worker process. Warm preprocessors
+        are kept for the life of the process, so its kernel serves the next
+        candidates too.
+        '''
+        if not self.warm_kernels:
+            return self.preprocessor()
+        key = (self.kernel, self.cell_timeout, self.notebook_timeout, self.memory_limit, self.max_uses)
+        if key not in warm_preprocessors:
+            warm_preprocessors[key] = self.preprocessor()
+        return warm_preprocessors[key]
+
+
+def save_original_files(candidate_dir, save_originals):
+    if save_originals is None:
+        return None
+    for original_file in save_originals:
+        try:
+            shutil.copy(f'{candidate_dir}/{original_file}', f'{candidate_dir}/nbta_{original_file}')
+        except:
+            pass
+    return None
+
+
+def collect_errors(nb):
+    auth_errors = []
+    passed = True
+    for cell in nb['cells']:
+        if cell['cell_type'] == 'code':
+            for output in cell['outputs']:
+                if output['output_type'] == 'error':
+                    auth_errors.append(f"{output['ename']}: {output['evalue']}")
+                    passed = False
+    return passed, auth_errors
+
+
+def run_status(passed, auth_errors):
+    if passed:
+        return 'ok'
+    if any(error.startswith('MemoryError') for error in auth_errors):
+        return 'oom'
+    return 'error'
+
+
+def write_notebook(nb, path, compactor=None):
+    '''
+    Writes nb to path. With an OutputCompactor, a compacted copy is written
+    and nb itself (which may go to the ExecutionCache) is left whole.
+    '''
+    if compactor is not None:
+        nb = compactor.compact(copy.deepcopy(nb), os.path.dirname(path))
+    with open(path, mode='w', encoding='utf-8') as f:
+        nbf.write(nb, f)
+
+
+def clear_outputs(nb):
+    '''
+    Copy of nb with the outputs and execution counts of every code cell
+    removed, so that cells a run never reaches (after a timeout or a dead
+    kernel) cannot carry the outputs of an earlier run or candidate.
+    '''
+    nb = copy.deepcopy(nb)
+    for cell in nb['cells']:
+        if cell['cell_type'] == 'code':
+            cell['outputs'] = []
+            cell['execution_count'] = None
+    return nb
+
+
+def execute_marking_notebook(candidate_dir, notebook_name, nb, ep, save_originals=None, cache=None,
+                             compactor=None):
+    '''
+    Executes a marking notebook with the kernel working directory set to
+    candidate_dir and writes the result to <notebook_name>_marking.ipynb.
+
+    The working directory of the calling process is never changed, so several
+    candidates can be executed at the same time. When an ExecutionCache is
+    given and holds an entry for this notebook, the stored outputs are reused
+    and no kernel is started. An OutputCompactor shrinks the outputs of the
+    notebook written to disk. When nb is None, the marking notebook written
+    by NotebookMarker.insert_cells is read from disk. Returns the run status
+    (one of RUN_STATUSES) and the list of errors; the timings of the run are
+    left in ep.profile.
+    '''
+    notebook_filename_out = f'{candidate_dir}/{notebook_name}_marking.ipynb'
+    ep.profile = None
+
+    if nb is None:
+        try:
+            with open(notebook_filename_out, 'r', encoding='utf-8') as f:
+                nb = nbf.read(f, as_version=nbf.NO_CONVERT)
+        except Exception as e:
+            return 'error', [f'{type(e).__name__}: {e}']
+    nb = clear_outputs(nb)
+
+    if cache is not None:
+        key = cache.key(nb, ep.kernel_name, candidate_dir, notebook_name)
+        cached = cache.get(key)
+        if cached is not None:
+            executed, status, auth_errors = cached
+            write_notebook(cache.restore(nb, executed), notebook_filename_out, compactor)
+            ep.profile = {'cached': True}
+            return status, auth_errors
+
+    save_original_files(candidate_dir, save_originals)
+    status = None
+    kernel_errors = []
+
+    try:
+        ep.preprocess(nb, {'metadata': {'path': candidate_dir}})
+    except CellExecutionError as e:
+        print(e)
+    except CellTimeoutError as e:
+        status = 'timeout'
+        kernel_errors.append(f'CellTimeoutError: {e}'.split('\n')[0])
+    except DeadKernelError as e:
+        status = 'oom' if getattr(ep, 'memory_limit', None) is not None else 'kernel_error'
+        kernel_errors.append(f'DeadKernelError: {e}')
+    except (RuntimeError, TimeoutError) as e:
+        # the kernel could not be started or stopped answering
+        status = 'kernel_error'
+        kernel_errors.append(f'{type(e).__name__}: {e}')
+    finally:
+        write_notebook(nb, notebook_filename_out, compactor)
+
+    passed, auth_errors = collect_errors(nb)
+    auth_errors = auth_errors + kernel_errors
+    if status is None:
+        status = run_status(passed, auth_errors)
+
+    if cache is not None:
+        cache.put(key, nb, status, auth_errors)
+
+    return status, auth_errors
+
+
+def run_candidate(auth, candidate_dir, notebook_name, nb, settings):
+    '''
+    Entry point for the worker processes of NotebookMarker.run_notebooks.
+    Every call starts its own kernel through a fresh preprocessor, unless
+    settings.warm_kernels is set.
+    '''
+    profile = None
+    try:
+        ep = settings.worker_preprocessor()
+        status, auth_errors = execute_marking_notebook(candidate_dir, notebook_name, nb, ep,
+                                                       settings.save_originals, settings.cache, settings.compactor)
+        profile = ep.profile
+    except Exception as e:
+        status, auth_errors = 'kernel_error', [f'{type(e).__name__}: {e}']
+    return auth, status, auth_errors, profile
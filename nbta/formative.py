@@ -6,9 +6,16 @@ import pickle
 import numpy as np
 import pandas as pd
 from os import listdir
+import os
+import glob
+import hashlib
+import html
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
 from wordcloud import WordCloud, STOPWORDS
 from IPython.display import display
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from IPython.core.display import HTML
 from termcolor import colored
 
@@ -181,27 +188,116 @@ class CheckCode:
         
         return message
 
+def plot_bars(ax, heights, colors):
+    x_pos = np.arange(len(heights))
+    ax.bar(x_pos, heights, color=colors)
+    ax.set_xticks(x_pos)
+    ax.set_xticklabels(x_pos)
+    ax.set_yticks(list(range(0,110, 10)))
+    ax.set_ylabel('Percentage Answers', fontsize=14)
+    ax.set_xlabel('Answer Number', fontsize=14)
+    return ax
+
+
+def plot_word_cloud(ax, text):
+    # lower max_font_size, change the maximum number of word and lighten the background:
+    wordcloud = WordCloud(max_font_size=50, max_words=100, background_color="white", collocations=True).generate(text)
+    ax.imshow(wordcloud, interpolation="bilinear")
+    ax.axis("off")
+    return ax
+
+
+def render_figure(kind, data, output, dpi=100):
+    '''
+    Draws one quiz figure straight to a png file with the Agg renderer, without
+    pyplot, so it can run in a worker process. kind is 'bars' (data holds the
+    heights and colors) or 'wordcloud' (data is the text).
+    '''
+    if kind == 'bars':
+        fig = Figure(figsize=(9,9))
+        plot_bars(fig.subplots(1,1), *data)
+    else:
+        fig = Figure(figsize=(15,8))
+        plot_word_cloud(fig.subplots(1,1), data)
+        fig.tight_layout(pad=6.0)
+    fig.savefig(f'{output}.tmp.png', dpi=dpi)
+    os.replace(f'{output}.tmp.png', output)
+    return output
+
+
 class QuizCheck():
     '''
     QuizCheck offers a class to provide visual feedbacks on small quizes conducted through Google Forms.
     '''
-    def __init__(self, path, answer_file=None):
+    def __init__(self, path, answer_file=None, year=None):
         self.path = path
-        self.answers = self.build_dataframe(path)
+        self.year_cache = {}
+        self.answers = self.load_answers(path)
+        self.tables = None
         self.correct_answers = False
         if answer_file:
             self.correct_answers = pd.read_excel(f'{path}/{answer_file}')
       
         self.questions = self.get_questions(self.answers)
+        self.year = str(year) if year is not None else self.guess_year(self.answers)
         display(HTML(f'<h2>Number of questions:{len(self.questions)}</h2>'))
+
+    def guess_year(self, answers):
+        years = pd.to_datetime(answers['Timestamp'].str.slice(0, 10), errors='coerce').dt.year.dropna()
+        if len(years) == 0:
+            return 'this year'
+        return str(int(years.mode()[0]))
+
+    def cache_entry(self, path):
+        '''
+        Parsed answers and aggregates of the Google Forms exports in path,
+        pickled to <path>/nbta_quiz_cache.pkl. The entry is rebuilt when a
+        csv file is added, removed or modified.
+        '''
+        forms = sorted(form for form in listdir(path) if form.split('.')[-1]=="csv")
+        key = [(form, os.path.getmtime(f'{path}/{form}'), os.path.getsize(f'{path}/{form}')) for form in forms]
+        entry = self.year_cache.get(path)
+        cache_path = f'{path}/nbta_quiz_cache.pkl'
+        if entry is None and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as f:
+                    entry = pickle.load(f)
+            except Exception:
+                entry = None
+        if entry is None or entry['key'] != key:
+            entry = {'key': key, 'answers': self.build_dataframe(path), 'aggregates': {}}
+            self.save_entry(path, entry)
+        self.year_cache[path] = entry
+        return entry
+
+    def save_entry(self, path, entry):
+        cache_path = f'{path}/nbta_quiz_cache.pkl'
+        try:
+            with open(f'{cache_path}.tmp', 'wb') as f:
+                pickle.dump(entry, f)
+            os.replace(f'{cache_path}.tmp', cache_path)
+        except OSError as e:
+            print(f'Unable to cache the answers of {path}: {e}')
+
+    def load_answers(self, path):
+        return self.cache_entry(path)['answers']
+
+    def load_aggregate(self, path):
+        '''
+        Cached aggregate (see aggregate) of the answers in path for the
+        questions of this quiz.
+        '''
+        entry = self.cache_entry(path)
+        questions = tuple(self.questions)
+        if questions not in entry['aggregates']:
+            entry['aggregates'][questions] = self.aggregate(entry['answers'])
+            self.save_entry(path, entry)
+        return entry['aggregates'][questions]
     
     def build_dataframe(self, path):
         forms = [form for form in listdir(path) if form.split('.')[-1]=="csv"]
         forms.sort()
-        df = pd.read_csv(f'{path}/{forms[0]}')
-        for form in forms[1:]:
-            df = pd.concat([df,pd.read_csv(f'{path}/{form}')])
-        return df
+        return pd.concat([pd.read_csv(f'{path}/{form}') for form in forms])
      
     def get_questions(self, df):
         allColumns = list(df.columns)
@@ -211,6 +307,50 @@ class QuizCheck():
     
     def split_answers(self, answer):
         return answer.split(';')
+
+    def aggregate(self, answers):
+        '''
+        Percentage of respondents who gave each answer, for every question in
+        one pass. Multi-select answers (separated by ';') count once per
+        option. Returns a dict of question -> Series indexed by answer, sorted
+        by answer, and a dict of question -> True for free-text questions.
+        '''
+        long = answers[self.questions].melt(var_name='question', value_name='answer').dropna(subset=['answer'])
+        responses = long.groupby('question').size()
+        long['answer'] = long['answer'].astype(str).str.split(';')
+        counts = long.explode('answer').groupby(['question', 'answer']).size()
+        percentages = counts / responses.reindex(counts.index.get_level_values('question')).values * 100
+
+        tables = {question: pd.Series(dtype=float) for question in self.questions}
+        for question, table in percentages.groupby(level='question'):
+            tables[question] = table.droplevel('question')
+
+        first_scores = answers[[f'{question} [Score]' for question in self.questions]].bfill().iloc[0]
+        free_text = {question: str(first_scores[f'{question} [Score]']).startswith('-') for question in self.questions}
+        return tables, free_text
+
+    def answer_tables(self):
+        '''
+        Cached aggregate of this year's answers, shared by answer,
+        print_answers and get_percentage_right.
+        '''
+        if self.tables is None:
+            self.tables, self.free_text = self.load_aggregate(self.path)
+        return self.tables
+
+    def correct_percentages(self, tables):
+        '''
+        Percentage of respondents choosing each correct answer, as a Series
+        indexed by (question, answer), leaving out free-text questions.
+        '''
+        self.answer_tables()
+        long = pd.concat([tables[question] for question in self.questions], keys=self.questions,
+                         names=['question', 'answer'])
+        correct = self.correct_answers[self.questions].melt(var_name='question', value_name='answer').dropna()
+        correct = pd.MultiIndex.from_arrays([correct.question, correct.answer.astype(str)])
+        right = long[long.index.isin(correct)]
+        free_text = [question for question in self.questions if self.free_text[question]]
+        return right[~right.index.get_level_values('question').isin(free_text)]
     
     def num_to_words(self, num):
         dic = {
@@ -233,16 +373,22 @@ class QuizCheck():
             return num
 
 
-    def draw_WordCloud(self, question, image):
-        fig, ax = plt.subplots(1,1, figsize=(15,8))
+    def word_cloud_text(self, question):
         ans = self.answers[question].dropna()
-        text = " ".join(self.num_to_words(answer) for answer in ans.astype(str))
-    
-        # lower max_font_size, change the maximum number of word and lighten the background:
-        wordcloud = WordCloud(max_font_size=50, max_words=100, background_color="white", collocations=True).generate(text)
+        return " ".join(self.num_to_words(answer) for answer in ans.astype(str))
+
+    def correct_options(self, question):
+        if self.correct_answers is False or question not in self.correct_answers:
+            return []
+        return self.correct_answers[question].dropna().astype(str).tolist()
 
-        plt.imshow(wordcloud, interpolation="bilinear")
-        plt.axis("off")
+    def bar_colors(self, question):
+        correct = self.correct_options(question)
+        return ['green' if bar in correct else 'blue' for bar in self.answer_tables()[question].index]
+
+    def draw_WordCloud(self, question, image):
+        fig, ax = plt.subplots(1,1, figsize=(15,8))
+        plot_word_cloud(ax, self.word_cloud_text(question))
         fig.tight_layout(pad=6.0)
         #plt.rc('xtick',labelsize=10)
         #plt.rc('ytick',labelsize=30)
@@ -251,55 +397,22 @@ class QuizCheck():
     def format_numerical_answer(self, ans):
         ans = ans.dropna()
         nb_responses = len(ans)
-    
-        all_ans = []
-
-        for value in ans.values:
-            all_ans = all_ans+self.split_answers(value)
-        ans = pd.Series(all_ans)
-
-        data = ans.value_counts().sort_index(ascending=True)/nb_responses*100
+        data = ans.astype(str).str.split(';').explode().value_counts().sort_index(ascending=True)/nb_responses*100
 
         return data
 
     def draw_bars(self, question,  image):
         _, ax = plt.subplots(1,1, figsize=(9,9))
-        ans = self.answers[question].dropna()
-        nb_responses = len(ans)
-    
-        all_ans = []
-        for value in ans.values:
-            all_ans = all_ans+self.split_answers(value)
-        ans = pd.Series(all_ans)
-    
-        data = ans.value_counts().sort_index(ascending=True)/nb_responses*100
-
-        height = data.values
-        x_pos = np.arange(len(height))
-    
-        # Create colors
-        colors = []
-        for bar in data.index:
-            if bar in self.correct_answers[question].values:
-                colors.append('green')
-            else:
-                colors.append('blue')
-        
-        # Create bars
-        plt.bar(x_pos, height, color=colors)
-
-        # Create names on the x-axis
-        plt.xticks(x_pos, x_pos)
-        plt.yticks(list(range(0,110, 10)))
-        plt.ylabel('Percentage Answers', fontsize=14)
-        plt.xlabel('Answer Number', fontsize=14)
+        data = self.answer_tables()[question]
+        plot_bars(ax, data.values, self.bar_colors(question))
         
         # Show graph
         plt.show()
     
+        correct = self.correct_options(question)
         for i,label in enumerate(data.index):
             color=(0,0,0)
-            if label in self.correct_answers[question].values:
+            if label in correct:
                 color= "green"   
             display(HTML(f'<font color={color}>{i}:{label}</font>'))
         return ax
@@ -307,7 +420,8 @@ class QuizCheck():
     def answer(self, question_nb, correct_answers=[], image=None):
         question = self.questions[question_nb]
         display(HTML(f'<h2>{question}</h2>'))
-        if self.answers[f'{question} [Score]'].dropna()[0][0] == '-':
+        self.answer_tables()
+        if self.free_text[question]:
             self.draw_WordCloud(question, image)
         else:
             self.draw_bars(question, image)
@@ -319,29 +433,109 @@ class QuizCheck():
     def print_answers(self):
         for nbq in range(len(self.questions)):
             self.answer(nbq)
-    
-    def get_percentage_right(self, given_answers):
+
+    def figure_jobs(self):
+        '''
+        One (question, kind, data, key) tuple per question. The key hashes
+        everything drawn, so a figure only changes when its answers (or the
+        correct answers) do.
+        '''
+        self.answer_tables()
+        jobs = []
         for question in self.questions:
-            correct_answers = []
-            if self.answers[f'{question} [Score]'].dropna()[0][0] == '-':
-                pass
+            if self.free_text[question]:
+                kind, data = 'wordcloud', self.word_cloud_text(question)
             else:
-                data = self.format_numerical_answer(given_answers[question])
-                correct_answers = correct_answers+[data[ans] for ans in data.index if ans in self.correct_answers[question].values]
-        
-        return sum(correct_answers)/len(correct_answers)
+                table = self.answer_tables()[question]
+                kind, data = 'bars', (table.values.tolist(), self.bar_colors(question))
+            key = hashlib.sha256(repr((question, kind, data)).encode('utf-8')).hexdigest()[:16]
+            jobs.append((question, kind, data, key))
+        return jobs
+
+    def export_report(self, folder=None, workers=1, force=False, dpi=100):
+        '''
+        Usage: QuizCheck(path).export_report(workers=4)
+
+        Headless version of print_answers: renders the bar chart or word cloud
+        of every question to <folder>/figures (in a process pool when
+        workers > 1) and writes a static report to <folder>/index.html.
+        folder defaults to <path>/nbta_report. Figures whose answers have not
+        changed since the last export are reused unless force is set. Returns
+        the path of the report.
+        '''
+        folder = folder if folder is not None else f'{self.path}/nbta_report'
+        os.makedirs(f'{folder}/figures', exist_ok=True)
+        jobs = self.figure_jobs()
+        outputs = {question: f'figures/q{nbq}_{key}.png' for nbq, (question, _, _, key) in enumerate(jobs)}
+        to_render = [(kind, data, f'{folder}/{outputs[question]}', dpi) for question, kind, data, _ in jobs
+                     if force or not os.path.exists(f'{folder}/{outputs[question]}')]
+
+        if workers > 1 and len(to_render) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(render_figure, *job) for job in to_render]
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    future.result()
+        else:
+            for job in tqdm(to_render):
+                render_figure(*job)
+
+        # figures of answers that changed since are not linked anymore
+        kept = {f'{folder}/{output}' for output in outputs.values()}
+        for figure in glob.glob(f'{folder}/figures/q*_*.png'):
+            if figure not in kept:
+                os.remove(figure)
+
+        report_path = f'{folder}/index.html'
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write(self.report_html(outputs))
+        print(f'Rendered {len(to_render)} figures, reused {len(jobs) - len(to_render)}. Report written to {report_path}')
+        return report_path
+
+    def report_html(self, outputs):
+        title = html.escape(f'{os.path.basename(os.path.abspath(self.path))} {self.year}')
+        parts = ['<!DOCTYPE html>', '<html><head><meta charset="utf-8">', f'<title>{title}</title></head><body>',
+                 f'<h1>{title}</h1>', f'<h2>Number of questions:{len(self.questions)}</h2>']
+        for question in self.questions:
+            parts.append(f'<h2>{html.escape(question)}</h2>')
+            parts.append(f'<img src="{outputs[question]}" style="max-width:100%"/>')
+            if not self.free_text[question]:
+                correct = self.correct_options(question)
+                for i, label in enumerate(self.answer_tables()[question].index):
+                    color = 'green' if label in correct else 'black'
+                    parts.append(f'<div><font color={color}>{i}:{html.escape(str(label))}</font></div>')
+            parts.append(f'<h4><font color="grey">{"_"*100}</font></h4>')
+        parts.append('</body></html>')
+        return '\n'.join(parts) + '\n'
     
-    def compare_scores(self, other_years=[]):
-        bars = [self.get_percentage_right(self.answers)]
-        labels = ['2022']
-        colors = ['green']
+    def get_percentage_right(self, given_answers):
+        '''
+        Mean percentage of respondents choosing a correct answer, over the
+        correct answers of all questions that are not free text.
+        '''
+        if given_answers is self.answers:
+            tables = self.answer_tables()
+        else:
+            tables, _ = self.aggregate(given_answers)
 
-        if len(other_years)!=0:
-            for year in other_years:
-                other_answers = self.build_dataframe(f'{self.path}/{year}')
-                bars.append(self.get_percentage_right(other_answers))
-                labels.append(str(year))
-                colors.append('blue')
+        return self.correct_percentages(tables).mean()
+    
+    def compare_scores(self, other_years=[]):
+        '''
+        Compares the percentage of correct answers of this year with the
+        years in other_years (sub-folders of path). Aggregates come from the
+        cache of each folder. Returns a DataFrame with one row per question
+        and one column per year, kept as year_comparison.
+        '''
+        per_question = {}
+        bars = []
+        for label, path in [(self.year, self.path)] + [(str(year), f'{self.path}/{year}') for year in other_years]:
+            tables = self.answer_tables() if path == self.path else self.load_aggregate(path)[0]
+            right = self.correct_percentages(tables)
+            per_question[label] = right.groupby(level='question').mean()
+            bars.append(right.mean())
+        labels = list(per_question.keys())
+        colors = ['green'] + ['blue'] * len(other_years)
+        self.year_comparison = pd.DataFrame(per_question).reindex(self.questions).dropna(how='all')
 
         _, ax = plt.subplots(1,1, figsize=(9,9))
         
@@ -352,4 +546,6 @@ class QuizCheck():
         
         # Show graph
         plt.show()
+
+        return self.year_comparison
             
\ No newline at end of file
@@ -3,7 +3,9 @@ import numpy as np
 import ipywidgets as widgets
 from IPython.display import display, HTML
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from tqdm import tqdm
+from nbta.store import GradeStore
 
 class NBTATest:
     def __init__(self,folder=None,**kwargs):
@@ -20,6 +22,34 @@ class NBTATest:
     def get_results(self):
         return self.test_results
 
+def load_selection(store, candidate, question_name):
+    if store is not None:
+        selected = store.load_selection(candidate, question_name)
+        if selected is not None:
+            return np.array(selected, dtype=object)
+    try:
+        return pd.read_csv(f'grades/nbta_selection_{question_name}.csv')['options'].values
+    except:
+        return None
+
+
+def save_selection(store, candidate, question_name, values):
+    if store is not None:
+        store.save_selection(candidate, question_name, values)
+    else:
+        pd.Series(data=values,
+        dtype=object,
+        name='options').to_csv(f'grades/nbta_selection_{question_name}.csv', index=False)
+
+
+def save_first_marker(marker, base_dir='../..'):
+    store = GradeStore.find(base_dir)
+    if store is not None:
+        store.save_marker(os.path.basename(os.getcwd()), marker)
+    else:
+        pd.Series(data=[marker], name="marker_name").to_csv("grades/first_marker.csv", index=False)
+
+
 class QuestionGrader:
     def __init__(self, question_name, options=None, auto_tests=None, feedback=False):
         self.base_dir = '../..'
@@ -28,6 +58,9 @@ class QuestionGrader:
         self.auto_tests_results={}
         self.feedback = feedback
 
+        self.store = GradeStore.find(self.base_dir)
+        self.candidate = os.path.basename(os.getcwd())
+
         if not os.path.exists('grades'):
                 os.mkdir('grades')
 
@@ -35,22 +68,9 @@ class QuestionGrader:
             self.run_autotests()
 
         if self.feedback:
-            try:
-                self.selected_pos_feedback = pd.read_csv(f'grades/nbta_pos_feedback_{self.question_name}.txt')
-            except:
-                self.selected_pos_feedback = None
-            
-            try:
-                self.selected_neg_feedback = pd.read_csv(f'grades/nbta_neg_feedback_{self.question_name}.txt')
-            except:
-                self.selected_neg_feedback = None
-            
             self.feedback = self.set_feedback()
         else:
-            try:
-                self.selected_values = pd.read_csv(f'grades/nbta_selection_{self.question_name}.csv')['options'].values
-            except:
-                self.selected_values = None
+            self.selected_values = load_selection(self.store, self.candidate, self.question_name)
         
             if options is None:
                 self.options = self.read_options(f'{self.base_dir}/grading/testing/notebook_tests/{self.question_name}.csv')
@@ -66,7 +86,10 @@ class QuestionGrader:
         for name, test in self.auto_tests.items():
             res = test.run_test()
             res_df = pd.DataFrame.from_dict(res,orient='index').T
-            res_df.to_csv(f'grades/nbta_score_{name}.csv', index=False)
+            if self.store is not None:
+                self.store.save_scores(self.candidate, name, res_df.iloc[0].to_dict())
+            else:
+                res_df.to_csv(f'grades/nbta_score_{name}.csv', index=False)
             self.auto_tests_results[name] = res_df
             
     def read_options(self, path):
@@ -106,17 +129,8 @@ class QuestionGrader:
 
     def set_feedback(self):
         feedbacks = []
-        if self.selected_pos_feedback is not None:
-            with open(f'grades/nbta_pos_feedback_{self.question_name}.txt', 'r') as f:
-                pos_feedback_text = '\n'.join(f.readlines())
-        else:
-            pos_feedback_text = ' '
-        
-        if self.selected_neg_feedback is not None:
-            with open(f'grades/nbta_neg_feedback_{self.question_name}.txt', 'r') as f:
-                neg_feedback_text = '\n'.join(f.readlines())
-        else:
-            neg_feedback_text = ' '
+        pos_feedback_text = self.load_feedback('pos')
+        neg_feedback_text = self.load_feedback('neg')
 
         feedbacks.append(widgets.Textarea(
             value=pos_feedback_text,
@@ -131,6 +145,17 @@ class QuestionGrader:
             disabled=False))
         
         return feedbacks
+
+    def load_feedback(self, kind):
+        if self.store is not None:
+            text = self.store.load_feedback(self.candidate, self.question_name, kind)
+            if text is not None:
+                return text
+        try:
+            with open(f'grades/nbta_{kind}_feedback_{self.question_name}.txt', 'r') as f:
+                return '\n'.join(f.readlines())
+        except:
+            return ' '
     
     def display(self):
         if self.feedback:
@@ -161,15 +186,17 @@ class QuestionGrader:
 
     def save_values(self):
         if self.feedback:
-            with open(f'grades/nbta_pos_feedback_{self.question_name}.txt', 'w') as f:
-                f.write(self.feedback[0].value)
-            with open(f'grades/nbta_neg_feedback_{self.question_name}.txt', 'w') as f:
-                f.write(self.feedback[1].value)
+            if self.store is not None:
+                self.store.save_feedback(self.candidate, self.question_name, 'pos', self.feedback[0].value)
+                self.store.save_feedback(self.candidate, self.question_name, 'neg', self.feedback[1].value)
+            else:
+                with open(f'grades/nbta_pos_feedback_{self.question_name}.txt', 'w') as f:
+                    f.write(self.feedback[0].value)
+                with open(f'grades/nbta_neg_feedback_{self.question_name}.txt', 'w') as f:
+                    f.write(self.feedback[1].value)
             print(f'Saved feedbacks for {self.question_name}')
         else:
-            pd.Series(data=self.values().get('values'),
-            dtype=object, 
-            name='options').to_csv(f'grades/nbta_selection_{self.question_name}.csv', index=False)
+            save_selection(self.store, self.candidate, self.question_name, self.values().get('values'))
             print(f'Saved options for {self.question_name}')
 
 
@@ -178,13 +205,16 @@ class EstimatedMark:
     def __init__(self, question_name='estimated_mark', options=None, auto_tests=None):
         self.base_dir = '../..'
         self.question_name = question_name
+        self.store = GradeStore.find(self.base_dir)
+        self.candidate = os.path.basename(os.getcwd())
         self.grade_selector = self.set_grade_selector()
         self.display()
     
     def set_grade_selector(self):
-        try:
-            self.selected_option = pd.read_csv(f'grades/nbta_selection_{self.question_name}.csv')['options'].values.astype(str)
-        except:
+        selected = load_selection(self.store, self.candidate, self.question_name)
+        if selected is not None and len(selected) > 0:
+            self.selected_option = str(selected[0])
+        else:
             self.selected_option = '2.1'
 
         est_grade = widgets.RadioButtons(
@@ -200,8 +230,7 @@ class EstimatedMark:
         display(self.grade_selector)
         
     def save_values(self):
-        pd.Series(data=[self.grade_selector.value], 
-        name='options').to_csv(f'grades/nbta_selection_{self.question_name}.csv', index=False)
+        save_selection(self.store, self.candidate, self.question_name, [self.grade_selector.value])
         print(f'Saved {self.question_name}')
 
 
@@ -214,27 +243,40 @@ class GradingSchema():
         self.style = None
         self.grades = None
         self.ignore_feedbacks = ignore_feedbacks
+        self.load_report = None
 
     def load_marks(self, folder, candidates):
        
         self.folder = folder
         question_cols = pd.read_csv(f'grading/testing/notebook_tests/{self.name}.csv').options.values
-        cols = ['candidate']+list(question_cols)
-        marking = pd.DataFrame(data=[], columns=cols)
-        
-        for candidate in tqdm(candidates):
-            init_values = [candidate] + [False for _ in question_cols]
-            marking.loc[marking.shape[0]] = init_values
+        selections = []
+        failures = []
+        remaining = candidates
+
+        if GradeStore.exists():
+            store = GradeStore()
+            selected = store.selections(self.name)
+            selected = selected[selected.candidate.isin(candidates)]
+            # the store keeps options as text, match them back to the option labels
+            labels = dict(zip([str(c) for c in question_cols], question_cols))
+            selected = selected.assign(option=[labels.get(option, option) for option in selected.option])
+            selections.append(selected)
+            saved = store.saved_candidates(self.name)
+            # candidates marked before the store was created still have their files
+            remaining = [c for c in candidates if c not in saved]
+
+        for candidate in tqdm(remaining):
             try:
                 base_dir = f'{folder}/{candidate}/grades'
                 values = pd.read_csv(f'{base_dir}/nbta_selection_{self.name}.csv')['options'].values
-                idx = marking[marking.candidate==candidate].index
-                marking.loc[idx,values] = True
+                selections.append(pd.DataFrame({'candidate': candidate, 'option': values}))
             except Exception as e:
-                print(f'Failed on candidate {candidate}: {e}')
-        
-        for bool_question in question_cols:
-            marking.loc[:,bool_question] = marking.loc[:,bool_question].astype(bool)
+                failures.append({'candidate': candidate, 'error': f'{type(e).__name__}: {e}'})
+
+        marking = self.option_matrix(selections, candidates, question_cols, failures)
+        self.load_report = pd.DataFrame(data=failures, columns=['candidate', 'error'])
+        if self.load_report.shape[0] > 0:
+            print(f'{self.name}: {self.load_report.shape[0]} problem(s) while loading marks, see load_report')
 
         if self.add_tests is not None:
             for test in self.add_tests:
@@ -244,6 +286,32 @@ class GradingSchema():
         self.markings = marking.copy()
         return self
 
+    def option_matrix(self, selections, candidates, question_cols, failures):
+        '''
+        Turns the long (candidate, option) table of selected options into the
+        boolean marking table, with one row per candidate and one column per
+        option. Unknown options are added to failures.
+        '''
+        if len(selections) > 0:
+            selected = pd.concat(selections, ignore_index=True)
+        else:
+            selected = pd.DataFrame(data=[], columns=['candidate', 'option'])
+
+        known = selected.option.isin(question_cols)
+        for candidate, option in selected.loc[~known, ['candidate', 'option']].values:
+            failures.append({'candidate': candidate, 'error': f'Unknown option: {option}'})
+        selected = selected[known]
+
+        if selected.shape[0] > 0:
+            matrix = pd.crosstab(selected.candidate, selected.option) > 0
+        else:
+            matrix = pd.DataFrame(data=[], columns=question_cols, dtype=bool)
+        marking = matrix.reindex(index=candidates, columns=question_cols, fill_value=False).astype(bool)
+        marking.index.name = 'candidate'
+        marking.columns.name = None
+
+        return marking.reset_index()
+
     def build_feedback(self, values, all_feedbacks):
         if values['not_answered'] == 1:
             return f'You did not answer {self.name}.'
@@ -274,7 +342,42 @@ class GradingSchema():
 
         return feedback_string
 
-    def get_feedback(self):
+    def build_feedbacks(self, values, all_feedbacks):
+        '''
+        Vectorised equivalent of build_feedback for the whole marking table.
+        Every distinct combination of options is rendered only once.
+        '''
+        nb_rows = values.shape[0]
+        items = np.array([f'    • {self.feedback_dict.get(f)}\n' for f in all_feedbacks], dtype=object)
+        if len(all_feedbacks) > 0:
+            negative = values[all_feedbacks].to_numpy() == 0
+            patterns, inverse = np.unique(negative, axis=0, return_inverse=True)
+            rendered = np.array([self.render_options(pattern, items) for pattern in patterns], dtype=object)
+            feedbacks = rendered[inverse.reshape(-1)]
+        else:
+            feedbacks = np.full(nb_rows, '\n\n', dtype=object)
+
+        if 'additional_comments' in values.columns:
+            comments = values['additional_comments']
+            add_feedback = np.array([f'Additional feedback for this question: {c}\n\n' for c in comments], dtype=object)
+            feedbacks = feedbacks + np.where(comments.isin(['', ' ']), '', add_feedback)
+
+        if 'not_answered' in values.columns:
+            not_answered = (values['not_answered'] == 1).to_numpy(dtype=bool)
+            feedbacks = np.where(not_answered, f'You did not answer {self.name}.', feedbacks)
+
+        return pd.Series(data=list(feedbacks), index=values.index)
+
+    def render_options(self, negative, items):
+        pos_feedback_string = ''
+        neg_feedback_string = ''
+        if (~negative).any():
+            pos_feedback_string = f'You did the following well in {self.name}:\n' + ''.join(items[~negative])
+        if negative.any():
+            neg_feedback_string = f'Improvements in {self.name} would be possible for the following (either your did not do that, or not to the highest standard):\n' + ''.join(items[negative])
+        return f'{pos_feedback_string}\n{neg_feedback_string}\n'
+
+    def get_feedback(self, vectorized=True):
         feedback_options = pd.read_csv(f'grading/testing/notebook_tests/{self.name}.csv')
         self.feedback_dict = dict(zip(feedback_options.options.values,feedback_options.feedback.values))
         feedbacks = pd.DataFrame()
@@ -294,8 +397,11 @@ class GradingSchema():
         all_feedbacks = neg_feedbacks + pos_feedbacks
 
         print(f"Generating feedback for {self.name}:")
-        for index, row in tqdm(values.iterrows()):
-            feedbacks.loc[index,'feedback'] = f'{self.build_feedback(row,all_feedbacks)}'
+        if vectorized:
+            feedbacks['feedback'] = self.build_feedbacks(values, all_feedbacks)
+        else:
+            for index, row in tqdm(values.iterrows()):
+                feedbacks.loc[index,'feedback'] = f'{self.build_feedback(row,all_feedbacks)}'
 
         self.feedbacks = feedbacks
 
@@ -328,15 +434,40 @@ class GradingSchema():
         
         return self.grades
 
+def read_score_file(path):
+    try:
+        return pd.read_csv(path), None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+
 class TestBasedGradingSchema(GradingSchema):
     def __init__(self,test_name,total_points, external_test=True):
         self.name = test_name
         self.total_points = total_points
         self.external_test = external_test
+        self.load_report = None
 
         return None
 
-    def load_marks(self, folder, candidates):
+    def read_score_files(self, folder, candidates, workers=16):
+        paths = [f'{folder}/{candidate}/grades/nbta_score_{self.name}.csv' for candidate in candidates]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            outcomes = list(tqdm(pool.map(read_score_file, paths), total=len(paths)))
+
+        scores = []
+        failures = []
+        for candidate, (score, error) in zip(candidates, outcomes):
+            if error is None:
+                scores.append(score.assign(candidate=candidate))
+            else:
+                failures.append({'candidate': candidate, 'error': error})
+
+        if len(scores) > 0:
+            return pd.concat(scores, ignore_index=True), failures
+        return pd.DataFrame(data=[], columns=['candidate']), failures
+
+    def load_marks(self, folder, candidates, workers=16):
         results = pd.DataFrame()
         results['candidate'] = candidates
         self.folder = folder
@@ -349,23 +480,71 @@ class TestBasedGradingSchema(GradingSchema):
             except Exception as e:
                 print(f'Unable to load results:{e}')
         else:
-                columns = pd.read_csv(f"notebooks/{results['candidate'][0]}/grades/nbta_score_{self.name}.csv").columns
-                test_results = pd.DataFrame()
-                #test_results['candidate'] = results.candidate.copy()
-                test_results[columns] = pd.DataFrame(np.zeros((test_results.shape[0], columns.shape[0])))
-                for candidate in tqdm(results['candidate']):
-                    try:
-                        candidate_results = pd.read_csv(f'notebooks/{candidate}/grades/nbta_score_{self.name}.csv')
-                        candidate_results['candidate'] = candidate
-                        test_results = pd.concat([test_results, candidate_results])
-                    except Exception as e:
-                        print(f'Unable to load results:{e}')
+            if GradeStore.exists():
+                stored = GradeStore().scores(self.name)
+                if 'candidate' not in stored.columns:
+                    stored['candidate'] = []
+                found = set(stored.candidate)
+                scores, failures = self.read_score_files(folder, [c for c in candidates if c not in found], workers)
+                scores = pd.concat([stored, scores], ignore_index=True)
+            else:
+                scores, failures = self.read_score_files(folder, candidates, workers)
+            test_results = results.merge(scores, on='candidate', how='left')
+            self.load_report = pd.DataFrame(data=failures, columns=['candidate', 'error'])
+            if self.load_report.shape[0] > 0:
+                print(f'{self.name}: no score for {self.load_report.shape[0]} candidate(s), see load_report')
 
         self.markings = test_results.copy()
 
         return self
 
 
+STANDARD_COLUMNS = ['style_mark', 'estimated_mark', 'lecturer_comments', 'marker']
+# column filled by each file read in read_standard_values
+STANDARD_ARTEFACTS = {'pos_comments': 'lecturer_comments', 'neg_comments': 'lecturer_comments'}
+
+
+def read_text(path):
+    with open(path) as f:
+        return '\n'.join(f.readlines()).replace(',', ';')
+
+
+def read_standard_values(base_dir):
+    '''
+    Reads the style selection, estimated mark, first marker and private
+    feedback of one candidate. Returns the values and the list of files that
+    could not be read.
+    '''
+    readers = {
+        'style_mark': lambda: ';'.join(pd.read_csv(f'{base_dir}/nbta_selection_style.csv')['options'].astype(str).values),
+        'estimated_mark': lambda: pd.read_csv(f'{base_dir}/nbta_selection_estimated_mark.csv')['options'].values[0],
+        'marker': lambda: pd.read_csv(f'{base_dir}/first_marker.csv').values[0][0],
+        'pos_comments': lambda: read_text(f'{base_dir}/nbta_pos_feedback_Private_feedback_for_lecturer.txt'),
+        'neg_comments': lambda: read_text(f'{base_dir}/nbta_neg_feedback_Private_feedback_for_lecturer.txt'),
+    }
+    values = {}
+    gaps = []
+    for artefact, reader in readers.items():
+        try:
+            values[artefact] = reader()
+        except Exception as e:
+            values[artefact] = None
+            gaps.append({'artefact': artefact, 'error': f'{type(e).__name__}: {e}'})
+
+    pos_text = values.pop('pos_comments')
+    neg_text = values.pop('neg_comments')
+    if pos_text is None and neg_text is None:
+        values['lecturer_comments'] = None
+    else:
+        values['lecturer_comments'] = f"{pos_text or ''} - {neg_text or ''}"
+
+    return values, gaps
+
+
+def schema_feedback(schema):
+    return schema.get_feedback()
+
+
 class Grader():
     def __init__(self, marker, schemas):
         self.marker = marker
@@ -373,44 +552,110 @@ class Grader():
         self.style_schema = GradingSchema('style',100)
         self.schemas = dict(zip([s.name for s in schemas],schemas))
         self.folder = self.marker.base_dir
+        self.standard_gaps = None
 
-    def make_feedback(self, pre='', post=''):
-        self.grades['feedback'] = self.grades['candidate'].apply(lambda x: f'{pre}\n')
-        
-        for q in tqdm(self.schemas.keys()):
-            current_feedback = self.grades[['candidate','feedback']].copy()
-            current_feedback = current_feedback.merge(self.schemas.get(q).get_feedback(), on='candidate')
-            current_feedback['feedback'] = current_feedback['feedback_x'] + current_feedback['feedback_y']
-            self.grades['feedback'] = current_feedback['feedback'].copy()
+    def make_feedback(self, pre='', post='', workers=1, individual=False):
+        feedbacks = self.schema_feedbacks(workers)
+        candidates = self.grades['candidate'].values
 
+        if individual:
+            self.grades['feedback_file'] = self.write_individual_feedback(feedbacks, candidates, pre, post)
+            return self
 
-        self.grades['feedback'] = self.grades['feedback'].apply(lambda x: f'{x}{post}')
+        combined = np.full(len(candidates), f'{pre}\n', dtype=object)
+        for feedback in feedbacks.values():
+            combined = combined + feedback.reindex(candidates).fillna('').to_numpy(dtype=object)
+        self.grades['feedback'] = list(combined + post)
 
         return self
 
+    def schema_feedbacks(self, workers=1):
+        '''
+        Returns the feedback of every schema as a Series indexed by candidate,
+        computing the schemas in parallel when workers > 1.
+        '''
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(schema_feedback, self.schemas.values()))
+            for schema, feedback in zip(self.schemas.values(), results):
+                schema.feedbacks = feedback
+        else:
+            results = [schema.get_feedback() for schema in tqdm(self.schemas.values())]
+
+        return {name: feedback.drop_duplicates('candidate').set_index('candidate')['feedback']
+                for name, feedback in zip(self.schemas.keys(), results)}
+
+    def write_individual_feedback(self, feedbacks, candidates, pre='', post=''):
+        folder = 'grading/scores/individual'
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        feedback_columns = [feedback.to_dict() for feedback in feedbacks.values()]
+        paths = []
+        for candidate in tqdm(candidates):
+            path = f'{folder}/{candidate}.txt'
+            with open(path, 'w') as f:
+                f.write(f'{pre}\n')
+                for feedback in feedback_columns:
+                    f.write(feedback.get(candidate, ''))
+                f.write(post)
+            paths.append(path)
+        return paths
+
     def reset_grades(self):
         self.grades = pd.DataFrame()
         self.grades['candidate'] = self.marker.candidates
 
-    def get_standard_columns(self):
-        standard_values = pd.DataFrame()
-        standard_values['candidate'] = self.grades['candidate'].values
-        standard_values['style_mark','estimated_mark','lecturer_comments', 'marker']=np.nan
-        
-        for idx, row in  tqdm(standard_values.iterrows()):
-            base_dir = f'{self.folder}/{row.candidate}/grades'
-            standard_values.loc[idx,'style_mark'] = ';'.join(pd.read_csv(f'{base_dir}/nbta_selection_style.csv')['options'].values)
-            standard_values.loc[idx,'estimated_mark'] = pd.read_csv(f'{base_dir}/nbta_selection_estimated_mark.csv')['options'].values[0]
-            standard_values.loc[idx,'marker'] = pd.read_csv(f'{base_dir}/first_marker.csv').values[0]
-
-            with open(f'{base_dir}/nbta_pos_feedback_Private_feedback_for_lecturer.txt') as f:
-                pos_text = f.readlines()
-            with open(f'{base_dir}/nbta_neg_feedback_Private_feedback_for_lecturer.txt') as f:
-                neg_text = f.readlines()
-
-            standard_values.loc[idx,'lecturer_comments'] = '\n'.join(pos_text).replace(',', ';') + ' - ' + '\n'.join(neg_text).replace(',', ';')
-        
-        return standard_values
+    def get_standard_columns(self, workers=16):
+        '''
+        Style mark, estimated mark, lecturer comments and first marker of every
+        candidate, from the grade store when it exists. Values missing from
+        the store are read from the candidates' grades/ files.
+        '''
+        candidates = self.grades['candidate'].values
+        if GradeStore.exists():
+            standard_values = self.store_standard_columns(GradeStore(), candidates)
+        else:
+            standard_values = pd.DataFrame({'candidate': candidates}).reindex(columns=['candidate'] + STANDARD_COLUMNS)
+
+        incomplete = standard_values.candidate[standard_values[STANDARD_COLUMNS].isna().any(axis=1)].tolist()
+        base_dirs = [f'{self.folder}/{candidate}/grades' for candidate in incomplete]
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(tqdm(pool.map(read_standard_values, base_dirs), total=len(base_dirs)))
+
+        rows = [{'candidate': candidate, **values} for candidate, (values, _) in zip(incomplete, results)]
+        from_files = pd.DataFrame(data=rows, columns=['candidate'] + STANDARD_COLUMNS).set_index('candidate')
+        missing = standard_values.set_index('candidate')[STANDARD_COLUMNS].isna()
+        # only report the files of values the store did not have either
+        gaps = [{'candidate': candidate, **gap}
+                for candidate, (_, candidate_gaps) in zip(incomplete, results) for gap in candidate_gaps
+                if missing.loc[candidate, STANDARD_ARTEFACTS.get(gap['artefact'], gap['artefact'])]]
+
+        standard_values = standard_values.set_index('candidate').fillna(from_files).reset_index()
+        self.standard_gaps = pd.DataFrame(data=gaps, columns=['candidate', 'artefact', 'error'])
+        if self.standard_gaps.shape[0] > 0:
+            print(f'{self.standard_gaps.shape[0]} missing or unreadable value(s), see standard_gaps')
+
+        return standard_values[['candidate'] + STANDARD_COLUMNS]
+
+    def store_standard_columns(self, store, candidates):
+        standard_values = pd.DataFrame({'candidate': candidates})
+
+        style = store.selections('style').groupby('candidate').option.agg(';'.join)
+        style = style.reindex(list(store.saved_candidates('style')), fill_value='').rename('style_mark')
+        estimated = store.selections('estimated_mark').groupby('candidate').option.first().rename('estimated_mark')
+        markers = store.markers().set_index('candidate').marker
+        comments = store.feedbacks('Private_feedback_for_lecturer').pivot(index='candidate', columns='kind', values='text')
+        comments = comments.reindex(columns=['pos', 'neg']).fillna('').astype(str)
+        lecturer_comments = (comments['pos'].str.replace(',', ';') + ' - '
+                             + comments['neg'].str.replace(',', ';')).rename('lecturer_comments')
+
+        for artefact, column in [('style_mark', style), ('estimated_mark', estimated),
+                                 ('lecturer_comments', lecturer_comments), ('marker', markers)]:
+            standard_values[artefact] = standard_values.candidate.map(column)
+
+        return standard_values[['candidate'] + STANDARD_COLUMNS]
     
 
     def grade(self, questions=None):
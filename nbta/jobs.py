@@ -0,0 +1,186 @@
+import pandas as pd
+import os
+import socket
+import sqlite3
+import time
+
+JOB_STATES = ['pending', 'running', 'done', 'failed']
+DONE_STATUSES = ['ok', 'error']
+RETRY_STATUSES = ['kernel_error']
+JOB_COLUMNS = ['candidate', 'state', 'priority', 'attempts', 'available_at', 'status', 'message', 'updated']
+
+
+def session_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def session_gone(owner):
+    '''
+    True when owner names a process of this machine that no longer exists.
+    Sessions of other machines cannot be checked and count as alive.
+    '''
+    if owner is None:
+        return False
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except (PermissionError, ValueError):
+        return False
+    return False
+
+
+class RunQueue():
+    '''
+    Usage: RunQueue(path='grading/scores/nbta_queue.sqlite')
+
+    Persistent queue of candidate executions. Every candidate is a job in one
+    of JOB_STATES. Jobs are claimed by priority (highest first), so a cohort
+    can be processed in chunks over several sessions. Kernel failures are
+    retried with exponential backoff up to max_retries times. Running jobs
+    record the session (host:pid) that claimed them, see recover.
+    '''
+
+    def __init__(self, path='grading/scores/nbta_queue.sqlite', max_retries=3, backoff=30):
+        self.path = path
+        self.max_retries = max_retries
+        self.backoff = backoff
+        folder = os.path.dirname(self.path)
+        if folder != '' and not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+        self.execute('CREATE TABLE IF NOT EXISTS jobs (candidate TEXT PRIMARY KEY, state TEXT, priority INTEGER, '
+                     'attempts INTEGER, available_at REAL, status TEXT, message TEXT, updated REAL, owner TEXT)')
+        # queues created before jobs recorded their session
+        connection = self.connect()
+        try:
+            columns = [row[1] for row in connection.execute('PRAGMA table_info(jobs)').fetchall()]
+        finally:
+            connection.close()
+        if 'owner' not in columns:
+            self.execute('ALTER TABLE jobs ADD COLUMN owner TEXT')
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+    def execute(self, query, rows=None):
+        connection = self.connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            if rows is None:
+                connection.execute(query)
+            else:
+                connection.executemany(query, rows)
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+
+    def enqueue(self, candidates, priority=0, reset=False):
+        '''
+        Adds candidates as pending jobs. Candidates already in the queue are
+        left alone unless reset is True, in which case they are queued again
+        with the new priority.
+        '''
+        now = time.time()
+        rows = [(candidate, 'pending', priority, 0, now, None, None, now) for candidate in candidates]
+        columns = f"({', '.join(JOB_COLUMNS)}) VALUES ({', '.join('?' * len(JOB_COLUMNS))})"
+        if reset:
+            self.execute(f'INSERT OR REPLACE INTO jobs {columns}', rows)
+        else:
+            self.execute(f'INSERT OR IGNORE INTO jobs {columns}', rows)
+        return self
+
+    def requeue(self, states=['failed'], priority=10):
+        now = time.time()
+        placeholders = ','.join('?' * len(states))
+        self.execute(f"UPDATE jobs SET state = 'pending', priority = ?, attempts = 0, available_at = ?, "
+                     f"updated = ? WHERE state IN ({placeholders})", [[priority, now, now] + list(states)])
+        return self
+
+    def recover(self, older_than=3600, candidates=None):
+        '''
+        Puts back jobs left running by a session that died: right away when
+        that session ran on this machine and its process is gone, otherwise
+        once the job has been running for longer than older_than seconds.
+        candidates optionally restricts the jobs that can be recovered.
+        Returns the recovered candidates.
+        '''
+        now = time.time()
+        connection = self.connect()
+        try:
+            rows = connection.execute("SELECT candidate, owner, updated FROM jobs WHERE state = 'running'").fetchall()
+        finally:
+            connection.close()
+        stale = [candidate for candidate, owner, updated in rows
+                 if (candidates is None or candidate in candidates)
+                 and (updated < now - older_than or session_gone(owner))]
+        # the state check leaves alone a job completed in the meantime
+        self.execute("UPDATE jobs SET state = 'pending', owner = NULL, updated = ? "
+                     "WHERE candidate = ? AND state = 'running'", [(now, candidate) for candidate in stale])
+        if len(stale) > 0:
+            print(f'Recovered {len(stale)} job(s) left running by a dead session')
+        return stale
+
+    def claim(self, limit=1, candidates=None):
+        '''
+        Atomically marks up to limit available pending jobs as running and
+        returns their candidates, highest priority first. candidates optionally
+        restricts the jobs that can be claimed.
+        '''
+        now = time.time()
+        connection = self.connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            rows = connection.execute("SELECT candidate FROM jobs WHERE state = 'pending' AND available_at <= ? "
+                                      "ORDER BY priority DESC, candidate", (now,)).fetchall()
+            claimed = [row[0] for row in rows if candidates is None or row[0] in candidates][:limit]
+            connection.executemany("UPDATE jobs SET state = 'running', attempts = attempts + 1, updated = ?, "
+                                   "owner = ? WHERE candidate = ?",
+                                   [(now, session_name(), candidate) for candidate in claimed])
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+        return claimed
+
+    def next_available(self, candidates=None):
+        connection = self.connect()
+        try:
+            rows = connection.execute("SELECT candidate, available_at FROM jobs WHERE state = 'pending'").fetchall()
+        finally:
+            connection.close()
+        times = [available_at for candidate, available_at in rows if candidates is None or candidate in candidates]
+        if len(times) == 0:
+            return None
+        return min(times)
+
+    def complete(self, candidate, status, message):
+        now = time.time()
+        connection = self.connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            attempts = connection.execute('SELECT attempts FROM jobs WHERE candidate = ?', (candidate,)).fetchone()
+            attempts = 0 if attempts is None else attempts[0]
+            if status in DONE_STATUSES:
+                state, available_at = 'done', now
+            elif status in RETRY_STATUSES and attempts <= self.max_retries:
+                state, available_at = 'pending', now + self.backoff * 2 ** (attempts - 1)
+            else:
+                state, available_at = 'failed', now
+            connection.execute('UPDATE jobs SET state = ?, available_at = ?, status = ?, message = ?, updated = ? '
+                               'WHERE candidate = ?', (state, available_at, status, str(message), now, candidate))
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+        return state
+
+    def load(self):
+        connection = self.connect()
+        try:
+            return pd.read_sql_query('SELECT * FROM jobs ORDER BY priority DESC, candidate', connection)
+        finally:
+            connection.close()
+
+    def summary(self):
+        return self.load()['state'].value_counts().reindex(JOB_STATES, fill_value=0)
@@ -1,15 +1,156 @@
 import nbformat as nbf
-from nbconvert.preprocessors import ExecutePreprocessor
-from nbconvert.preprocessors import CellExecutionError
+from nbformat.corpus.words import generate_corpus_id as random_cell_id
 import pandas as pd
+import copy
+import hashlib
+import json
 import sys
 import os
+import re
+import time
 from os import path
-import shutil
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from nbta.utils import footer_cell, header_cell, header_code_cell
+from nbta.execution import ExecutionSettings, execute_marking_notebook, run_candidate
+from nbta.cache import ExecutionCache
+from nbta.runlog import RunLog
+from nbta.profiling import ProfileLog
+from nbta.autotests import run_test
+from nbta.jobs import RunQueue
+from nbta.shards import in_shard, parse_shard, shard_dir, queue_path
 from tqdm import tqdm
 
 
+def grader_metadata(name):
+    '''
+    Cell metadata marking a cell as inserted by nbta, so that execution
+    profiles can tell grader cells from the candidate's own code.
+    '''
+    return {'nbta': {'role': 'grader', 'name': name}}
+
+
+cell_templates = {}
+
+
+def template_cell(cell_type, source, name=None):
+    '''
+    New cell with a fresh id, copied from a cached cell with the same content.
+    nbf.v4.new_*_cell validates every cell against the notebook schema, which
+    used to take most of the time of insert_cells.
+    '''
+    key = (cell_type, source, name)
+    if key not in cell_templates:
+        kwargs = {} if name is None else {'metadata': grader_metadata(name)}
+        if cell_type == 'code':
+            cell_templates[key] = nbf.v4.new_code_cell(source=source, **kwargs)
+        else:
+            cell_templates[key] = nbf.v4.new_markdown_cell(source=source, **kwargs)
+    cell = copy.deepcopy(cell_templates[key])
+    cell['id'] = random_cell_id()
+    return cell
+
+
+def notebook_hash(nb):
+    '''
+    Hash of the content of a notebook, leaving out cell ids and the generation
+    time in the header of marking notebooks, which change at every run.
+    '''
+    cells = nb['cells']
+    if len(cells) > 0 and cells[0]['cell_type'] == 'markdown' and cells[0]['source'].startswith('# MARKING NOTEBOOK'):
+        cells = cells[1:]
+    content = {'metadata': nb.get('metadata', {}), 'nbformat': [nb.get('nbformat'), nb.get('nbformat_minor')],
+               'cells': [[cell['cell_type'], cell['source'], cell.get('metadata', {}), cell.get('outputs')]
+                         for cell in cells]}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def make_marking_notebook(candidate, path, marking_name, new_cells, force=False):
+    '''
+    Worker for NotebookMarker.insert_cells: parses a candidate's notebook,
+    inserts the marking cells and writes the marking notebook unless it has
+    not changed. Errors are returned instead of raised.
+    '''
+    try:
+        notebook = ParsedNotebook(path, candidate, marking_name)
+        written = notebook.insert_cells(new_cells).write(skip_unchanged=not force)
+    except Exception as e:
+        return candidate, 'failed', f'{type(e).__name__}: {e}'
+    return candidate, 'written' if written else 'unchanged', None
+
+
+class NotebookStreamWriter():
+    '''
+    Usage: NotebookStreamWriter(path)
+
+    Writes a notebook cell by cell instead of building it in memory first.
+    Every cell gets a fresh id, as the same cells come from many copies of
+    one assignment notebook. close() writes the notebook metadata.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write('{\n "cells": [')
+        self.nb_cells = 0
+
+    def write_cells(self, cells):
+        for cell in cells:
+            cell = dict(cell)
+            cell['id'] = random_cell_id()
+            if self.nb_cells > 0:
+                self.file.write(',')
+            self.file.write('\n  ' + json.dumps(cell, ensure_ascii=False, sort_keys=True))
+            self.nb_cells += 1
+
+    def close(self):
+        if self.file.closed:
+            return None
+        empty = nbf.v4.new_notebook()
+        self.file.write('\n ],\n "metadata": ' + json.dumps(empty['metadata']) +
+                        f',\n "nbformat": {empty["nbformat"]},\n "nbformat_minor": {empty["nbformat_minor"]}\n}}\n')
+        self.file.close()
+        return None
+
+
+class TagIndex():
+    '''
+    Usage: TagIndex(new_cells)
+
+    Finds the MarkingCells whose tag occurs in a cell source with a single
+    regex scan, instead of one substring search per tag. The scan restarts one
+    character after each hit so overlapping tags are found, tags are tried
+    longest first, and a hit also counts for the shorter tags it contains:
+    '# Q10' still matches the tag '# Q1' as the plain `tag in source` test
+    did. matches() returns the MarkingCells in the order they were given.
+    '''
+
+    def __init__(self, new_cells):
+        self.new_cells = list(new_cells)
+        self.positions = {}
+        for position, new_cell in enumerate(self.new_cells):
+            self.positions.setdefault(new_cell.tag, []).append(position)
+        tags = sorted(self.positions, key=len, reverse=True)
+        self.contained = {tag: [other for other in tags if other in tag] for tag in tags}
+        self.pattern = None
+        if len(tags) > 0:
+            self.pattern = re.compile('|'.join(re.escape(tag) for tag in tags))
+
+    def matches(self, source):
+        if self.pattern is None:
+            return []
+        hits = set()
+        match = self.pattern.search(source)
+        while match is not None:
+            hits.update(self.contained[match.group(0)])
+            if match.start() >= len(source):
+                # an empty tag matched at the very end
+                break
+            match = self.pattern.search(source, match.start() + 1)
+        positions = sorted(position for tag in hits for position in self.positions[tag])
+        return [self.new_cells[position] for position in positions]
+
+
 class ParsedNotebook():
     '''
     Usage: ParsedNotebook(path, questions)
@@ -25,82 +166,119 @@ class ParsedNotebook():
         self.author = author
         self.modified_content = None
 
-    def insert_cells(self, new_cells):
+    def insert_cells(self, new_cells, tag_index=None):
         cells = self.content['cells']
+        if tag_index is None:
+            tag_index = TagIndex(new_cells)
         self.modified_content = self.content.copy()
-        modified_cells = header_cell(self.author) + [header_code_cell(self.author)]
+        header_code = header_code_cell(self.author)
+        header_code.metadata.update(grader_metadata('header'))
+        modified_cells = header_cell(self.author) + [header_code]
+        begin_marking = '<span style="color:darkred">==============================================================MARK THIS QUESTION BELOW=================================================================</span>\n<h1 style="color:darkred">YOUR MARKS</h1>'
 
         for this_cell in cells:
-            inserted = False
-            cells_before = []
-            cells_after = []
-            begin_marking = '<span style="color:darkred">==============================================================MARK THIS QUESTION BELOW=================================================================</span>\n<h1 style="color:darkred">YOUR MARKS</h1>'
-            for new_cell in new_cells:
-                if  new_cell.tag in this_cell['source']:
-                    if new_cell.position == 'before':
-                        if len(cells_before)==0:
-                            cells_before.append(nbf.v4.new_markdown_cell(source=begin_marking))
-                        cells_before.append(new_cell.cell)
-                    else:
-                        if len(cells_after)==0:
-                            cells_after.append(nbf.v4.new_markdown_cell(source=begin_marking)) 
-                        cells_after.append(new_cell.cell)
-                    inserted = True
-            if inserted:
-                cells_before.append(this_cell)
-                modified_cells = modified_cells + cells_before + cells_after
-            else:
+            matched_cells = tag_index.matches(this_cell['source'])
+            if len(matched_cells) == 0:
                 modified_cells.append(this_cell)
-
-        modified_cells.append(nbf.v4.new_markdown_cell(source='<h1 style="color:blue">Coding style and private feedback to lecturer</h1>"'))
-        modified_cells.append(nbf.v4.new_code_cell(source=footer_cell()))
+                continue
+            # every candidate gets its own copy of the marking cells, which the runs fill with outputs
+            cells_before = [copy.deepcopy(new_cell.cell) for new_cell in matched_cells if new_cell.position == 'before']
+            cells_after = [copy.deepcopy(new_cell.cell) for new_cell in matched_cells if new_cell.position != 'before']
+            if len(cells_before) > 0:
+                modified_cells.append(template_cell('markdown', begin_marking))
+                modified_cells.extend(cells_before)
+            modified_cells.append(this_cell)
+            if len(cells_after) > 0:
+                modified_cells.append(template_cell('markdown', begin_marking))
+                modified_cells.extend(cells_after)
+
+        modified_cells.append(template_cell('markdown', '<h1 style="color:blue">Coding style and private feedback to lecturer</h1>"'))
+        modified_cells.append(template_cell('code', footer_cell(), 'footer'))
         tests_list = [f'nbta_test_{c.name}' for c in new_cells]
         tests_list=tests_list+['nbta_test_style','nbta_estimated_mark','nbta_private_feedback']
         title_cell_text = '<h1 style="color:red">RUN the cell below to save your markings</h1>"'
-        modified_cells.append(nbf.v4.new_markdown_cell(source=title_cell_text))
+        modified_cells.append(template_cell('markdown', title_cell_text))
         final_cell_text = ','.join(tests_list)
         final_cell_code = ['# DONT FORGET TO SAVE:','',f'import os','',
         f'all_tests = [{final_cell_text}]','',
         f'for t in all_tests:',
         f'    t.save_values()','',
         f'print("Saved First Marker as:", os.getlogin())','',
-        f'pd.Series(data=[os.getlogin()], name="marker_name").to_csv("grades/first_marker.csv", index=False)']
+        f'from nbta.grading import save_first_marker',
+        f'save_first_marker(os.getlogin())']
         final_cell_code = '\n'.join(final_cell_code)
-        modified_cells.append(nbf.v4.new_code_cell(source=final_cell_code))
+        modified_cells.append(template_cell('code', final_cell_code, 'save'))
 
         self.modified_content['cells'] = modified_cells
 
         return self
 
     def yield_question_cells(self,start_question,end_question):
-        return_cells = [nbf.v4.new_markdown_cell(source=f'ANSWER FROM: {self.author}')]
-        in_scope = False
+        questions = [start_question] if end_question is None else [start_question, end_question]
+        return self.question_segments(questions)[0]
+
+    def question_segments(self, questions, tag_index=None):
+        '''
+        Splits the notebook into the answers to all questions in one pass. The
+        answer to a question runs from the first cell holding its tag up to the
+        next cell holding the tag of the following question. Returns one list
+        of cells per question, each starting with an ANSWER FROM cell.
+        '''
+        if tag_index is None:
+            tag_index = TagIndex(questions)
+        order = {id(question): index for index, question in enumerate(questions)}
+        answer_from = nbf.v4.new_markdown_cell(source=f'ANSWER FROM: {self.author}')
+        segments = [[answer_from] for question in questions]
+        in_scope = set()
+        done = set()
+
         for this_cell in self.content['cells']:
-            if start_question.tags in this_cell['source']:
-                in_scope = True
-                return_cells.append(this_cell)
-            if end_question is not None:
-                if end_question.tags in this_cell['source']:
-                    in_scope = False
-                    return return_cells
-            if in_scope:
-                return_cells.append(this_cell)
-        return return_cells
-
-    def execute_notebook(self, kernel):
-        ep = ExecutePreprocessor(timeout=99999999,kernel_name=kernel)
+            found = {order[id(question)] for question in tag_index.matches(this_cell['source'])}
+            started = {index for index in found if index not in done}
+            in_scope |= started
+            for index in started:
+                segments[index].append(this_cell)
+            for index in found:
+                # the tag of the next question ends the previous answer
+                if index > 0 and index - 1 not in done:
+                    done.add(index - 1)
+                    in_scope.discard(index - 1)
+            for index in in_scope - started:
+                segments[index].append(this_cell)
+        return segments
+
+    def execute_notebook(self, kernel, cell_timeout=None, notebook_timeout=None, memory_limit=None):
+        ep = ExecutionSettings(kernel, cell_timeout=cell_timeout, notebook_timeout=notebook_timeout,
+                               memory_limit=memory_limit).preprocessor()
+        ep.allow_errors = False
         ep.preprocess(self.modified_content)
 
         return None
 
-    def write(self):
+    def write(self, skip_unchanged=False):
+        '''
+        Writes the notebook to <file_name>.ipynb. With skip_unchanged, nothing
+        is written when the content is the same as at the last write, which
+        also keeps the outputs of a marking notebook that was executed since.
+        Returns True when the file was written.
+        '''
         if self.modified_content is None:
             content = self.content
         else:
             content = self.modified_content
 
+        hash_path = f'{os.path.dirname(self.file_name)}/.nbta_{os.path.basename(self.file_name)}.sha256'
+        content_hash = notebook_hash(content)
+        if skip_unchanged and os.path.exists(f'{self.file_name}.ipynb') and os.path.exists(hash_path):
+            with open(hash_path, 'r') as f:
+                if f.read() == content_hash:
+                    return False
+
         with open(f'{self.file_name}.ipynb', 'w') as f:
             nbf.write(content,f)
+        with open(hash_path, 'w') as f:
+            f.write(content_hash)
+        return True
 
 class MarkingCell():
     def __init__(self, name, tag, cell_type='code', position='before', from_file=True, source_data=None):
@@ -125,9 +303,9 @@ class MarkingCell():
                 self.initialise_styles(style_path)
 
         if cell_type == 'code':
-            self.cell = nbf.v4.new_code_cell(source=source)
+            self.cell = nbf.v4.new_code_cell(source=source, metadata=grader_metadata(name))
         elif cell_type == 'markdown':
-            self.cell = nbf.v4.new_markdown_cell(source=source)
+            self.cell = nbf.v4.new_markdown_cell(source=source, metadata=grader_metadata(name))
         else:
             raise Exception(f"Unknown cell type: {cell_type}")
         self.tag = tag
@@ -173,19 +351,54 @@ class FeedbackCell:
         self.position = position
 
         source = f"nbta_test_{self.name} = QuestionGrader('{self.name}', feedback=True)"
-        self.cell = nbf.v4.new_code_cell(source=source)
+        self.cell = nbf.v4.new_code_cell(source=source, metadata=grader_metadata(self.name))
         return None
 
+class LazyNotebooks(Mapping):
+    '''
+    Usage: LazyNotebooks(marker)
+
+    Read-only mapping of candidate to ParsedNotebook that only parses a
+    notebook the first time it is accessed.
+    '''
+
+    def __init__(self, marker):
+        self.marker = marker
+        self.loaded = {}
+
+    def __getitem__(self, candidate):
+        if candidate not in self.loaded:
+            if candidate not in self.marker.candidates:
+                raise KeyError(candidate)
+            self.loaded[candidate] = self.marker.load_notebook(candidate)
+        return self.loaded[candidate]
+
+    def __iter__(self):
+        return iter(self.marker.candidates)
+
+    def __len__(self):
+        return len(self.marker.candidates)
+
+
 class NotebookMarker():
-    def __init__(self, folder, notebook_name, questions=None,name_func=None):
+    def __init__(self, folder, notebook_name, questions=None,name_func=None, lazy=False, shard=None):
         self.notebook_name = notebook_name
         self.name_func = name_func
         self.base_dir = folder
         self.marking_name = f'{self.notebook_name}_marking'
         self.questions = questions
-        self.candidates = self.filter_dirs(os.listdir(self.base_dir))
-        self.notebooks = self.get_notebooks()
+        self.lazy = lazy
+        # with shard='i/N' this marker only sees its share of the candidates and
+        # writes its scores to grading/scores/shards/i-of-N (see nbta.shards)
+        self.shard = parse_shard(shard)
+        self.scores_dir = shard_dir(self.shard)
+        self.candidates = in_shard(self.filter_dirs(os.listdir(self.base_dir)), self.shard)
+        if self.lazy:
+            self.notebooks = LazyNotebooks(self)
+        else:
+            self.notebooks = self.get_notebooks()
         self.test_list = None
+        self.test_reports = {}
 
     def filter_dirs(self, candidates):
         if '.DS_Store' in candidates:
@@ -194,136 +407,286 @@ class NotebookMarker():
             candidates.remove('.ipynb_checkpoints')
         return candidates
 
-    def insert_cells(self, cells_data=None):
+    def insert_cells(self, cells_data=None, workers=1, force=False):
+        '''
+        Writes the marking notebook of every candidate. Notebooks whose content
+        has not changed since the last call are left untouched unless force is
+        True. With workers > 1 the candidates are spread over a process pool
+        and the marking notebooks are read back from disk by run_notebooks.
+        '''
         if cells_data is None:
             if self.questions is None:
                 return self
             cells_data = self.questions
 
-        for auth, notebook in self.notebooks.items():
-            notebook.insert_cells(cells_data).write()
+        outcomes = {}
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(make_marking_notebook, candidate,
+                                       f'{self.base_dir}/{candidate}/{self.notebook_name}.ipynb',
+                                       self.marking_name, cells_data, force)
+                           for candidate in self.candidates]
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    candidate, state, error = future.result()
+                    outcomes[candidate] = (state, error)
+        else:
+            tag_index = TagIndex(cells_data)
+            for candidate in tqdm(self.candidates):
+                if not self.lazy and candidate not in self.notebooks:
+                    outcomes[candidate] = ('failed', 'the notebook could not be read')
+                    continue
+                try:
+                    notebook = self.notebooks[candidate]
+                    written = notebook.insert_cells(cells_data, tag_index).write(skip_unchanged=not force)
+                    outcomes[candidate] = ('written' if written else 'unchanged', None)
+                except Exception as e:
+                    outcomes[candidate] = ('failed', f'{type(e).__name__}: {e}')
+                if self.lazy and candidate in self.notebooks.loaded:
+                    # keep memory flat in lazy mode
+                    del self.notebooks.loaded[candidate]
+
+        self.insert_report = pd.DataFrame(data=[[candidate, state, error] for candidate, (state, error) in outcomes.items()],
+                                          columns=['candidate', 'state', 'error'])
+        for candidate, error in self.insert_report[self.insert_report.error.notna()][['candidate', 'error']].values:
+            print(f'Error on candidate {candidate}:{error}')
+        print(self.insert_report.state.value_counts().to_string())
         return self
 
+    def load_notebook(self, candidate):
+        path = f'{self.base_dir}/{candidate}/{self.notebook_name}.ipynb'
+        return ParsedNotebook(path, candidate, self.marking_name)
+
     def get_notebooks(self):
-        notebooks = {}
+        return dict(self.stream_notebooks())
+
+    def stream_notebooks(self):
         for candidate in self.candidates:
             try:
-                path = f'{self.base_dir}/{candidate}/{self.notebook_name}.ipynb'
-                notebook = ParsedNotebook(path, candidate, self.marking_name)
-                notebooks[candidate] = notebook
+                notebook = self.load_notebook(candidate)
             except Exception as e:
                 print(f'Error on candidate {candidate}:{e}')
-        return notebooks
+                continue
+            yield candidate, notebook
+
+    def iter_notebooks(self):
+        '''
+        Yields (candidate, ParsedNotebook) pairs. In lazy mode the notebooks are
+        parsed one at a time and not kept, so memory use does not grow with the
+        size of the cohort.
+        '''
+        if self.lazy:
+            return self.stream_notebooks()
+        return iter(self.notebooks.items())
+
+    def marking_content(self, auth):
+        if not self.lazy:
+            notebook = self.notebooks.get(auth)
+            if notebook is not None and notebook.modified_content is not None:
+                return notebook.modified_content.copy()
+        # read <notebook_name>_marking.ipynb from disk
+        return None
 
     def register_autotest(self):
         test_list = os.listdir("grading/testing/external_tests")
         test_list = [name.split('.')[0] for name in test_list if name.endswith(".py")]
         return test_list
 
-    def run_autotests(self):
+    def run_autotests(self, workers=1):
         test_results = {}
         sys.path.insert(0, f'{os.getcwd()}/grading/testing/external_tests')
         sys.path.insert(1, f'{os.getcwd()}/grading/testing/notebook_tests')
+        os.makedirs(self.scores_dir, exist_ok=True)
         for the_test in self.register_autotest():
             print(f"Now running test {the_test}")
-            test_results[the_test]= self.run_single_test(the_test)
-            test_results[the_test].to_csv(f'grading/scores/{the_test}.csv', index=False)
+            test_results[the_test]= self.run_single_test(the_test, workers)
+            test_results[the_test].to_csv(f'{self.scores_dir}/{the_test}.csv', index=False)
+            self.test_reports[the_test].to_csv(f'{self.scores_dir}/nbta_autotest_report_{the_test}.csv', index=False)
 
         self.test_results = test_results
         
         return self.test_results
 
-    def run_single_test(self, the_test):
-        results = None
-        
-        for candidate in tqdm(self.candidates):
-            mod = __import__(the_test, fromlist=[the_test])
-            tester = getattr(mod, the_test)
-            result = tester(folder=f'{self.base_dir}/{candidate}').run_test()
-
-            if results is None:
-                results = pd.DataFrame(data=[result.values()],columns=result.keys())
-                results['candidate'] = candidate
-            else:
-                formatted_result = pd.DataFrame(data=[result.values()],columns=result.keys())
-                formatted_result['candidate'] = candidate
-                results = pd.concat([results,formatted_result])
-        
+    def run_single_test(self, the_test, workers=1):
+        test_paths = [f'{os.getcwd()}/grading/testing/external_tests',
+                      f'{os.getcwd()}/grading/testing/notebook_tests']
+        outcomes = {}
+
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(run_test, the_test, test_paths, f'{self.base_dir}/{candidate}', candidate)
+                           for candidate in self.candidates]
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    candidate, result, error, duration = future.result()
+                    outcomes[candidate] = (result, error, duration)
+        else:
+            for candidate in tqdm(self.candidates):
+                candidate, result, error, duration = run_test(the_test, test_paths, f'{self.base_dir}/{candidate}', candidate)
+                outcomes[candidate] = (result, error, duration)
+
+        rows = []
+        report = []
+        for candidate in self.candidates:
+            result, error, duration = outcomes[candidate]
+            if error is None and not isinstance(result, dict):
+                error = f'run_test returned {type(result).__name__} instead of a dict'
+            # failed candidates keep a row, with empty scores, so they stay in the grade table
+            rows.append({**result, 'candidate': candidate} if error is None else {'candidate': candidate})
+            report.append({'candidate': candidate, 'test': the_test, 'duration': duration, 'error': error})
+
+        self.test_reports[the_test] = pd.DataFrame(data=report, columns=['candidate', 'test', 'duration', 'error'])
+        failures = self.test_reports[the_test].error.notna().sum()
+        if failures > 0:
+            print(f'{the_test} failed on {failures} candidate(s), see {self.scores_dir}/nbta_autotest_report_{the_test}.csv')
+
+        results = pd.DataFrame(data=rows)
+        if 'candidate' not in results.columns:
+            results['candidate'] = []
+        results = results[[column for column in results.columns if column != 'candidate'] + ['candidate']]
         return results.reset_index(drop=True)
 
 
 
-    def run_notebooks(self,save_originals=None, kernel='python3', first_run=True):
+    def run_notebooks(self,save_originals=None, kernel='python3', first_run=True, workers=1,
+                      cell_timeout=None, notebook_timeout=None, memory_limit=None, cache=False,
+                      warm_kernels=False, max_uses=50, compactor=None):
+        execution_cache = ExecutionCache() if cache else None
+        settings = ExecutionSettings(kernel, save_originals, cell_timeout, notebook_timeout, memory_limit,
+                                     execution_cache, warm_kernels, max_uses, compactor)
 
+        run_log = self.run_log()
+        profile_log = self.profile_log()
         if first_run:
-            try:
-                results = pd.read_csv('grading/scores/nbta_runs.csv')
-            except:
-                results = pd.DataFrame(data=[], columns=['candidate','status','message'])
+            done = run_log.import_csv(f'{self.scores_dir}/nbta_runs.csv').candidates()
+        else:
+            done = set()
+
+        to_run = [auth for auth in self.notebooks if auth not in done]
+
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(run_candidate, auth, self.candidate_dir(auth), self.notebook_name,
+                                       self.marking_content(auth), settings)
+                           for auth in to_run]
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    auth, status, auth_errors, profile = future.result()
+                    run_log.append(auth, status, auth_errors)
+                    profile_log.append(auth, status, profile)
+        else:
+            ep = settings.preprocessor()
 
-        ep = ExecutePreprocessor(kernel_name=kernel,
-        allow_errors=True)
+            for auth in tqdm(to_run):
+                status,auth_errors = self.run_single_notebook(auth, self.marking_content(auth),save_originals,ep,
+                                                              execution_cache, compactor)
+                run_log.append(auth, status, auth_errors)
+                profile_log.append(auth, status, ep.profile)
+            ep.close()
 
-        for auth, notebook in tqdm(self.notebooks.items()):
+        self.runs_results = run_log.export_csv(f'{self.scores_dir}/nbta_runs.csv')
 
-            if (first_run and auth not in results.candidate.values) or (not first_run):
-                passed,auth_errors = self.run_single_notebook(auth, notebook.modified_content.copy(),save_originals,ep)
-                row = {'candidate': auth, 'status': passed, 'message': auth_errors}
-                results = results.append(row, ignore_index = True)
-                results.to_csv('grading/scores/nbta_runs.csv', index=False)
-            
-        self.runs_results = pd.read_csv('grading/scores/nbta_runs.csv')
+        return self
+
+    def run_log(self):
+        return RunLog(f'{self.scores_dir}/nbta_runs.jsonl')
+
+    def profile_log(self):
+        return ProfileLog(f'{self.scores_dir}/nbta_profile.jsonl')
+
+    def run_summary(self):
+        return self.run_log().summary()
+
+    def profile_report(self, top=10, verbose=True):
+        '''
+        Slowest cells and candidates of the last runs, and the time spent in
+        student code versus the cells inserted by nbta.
+        '''
+        return self.profile_log().report(top, verbose)
+
+    def late_candidates(self, deadline):
+        '''
+        Candidates whose notebook was modified after deadline (a datetime).
+        '''
+        late = []
+        for candidate in self.candidates:
+            path = f'{self.base_dir}/{candidate}/{self.notebook_name}.ipynb'
+            if os.path.exists(path) and os.path.getmtime(path) > deadline.timestamp():
+                late.append(candidate)
+        return late
+
+    def run_queue(self, queue=None, limit=None, workers=1, save_originals=None, kernel='python3',
+                  cell_timeout=None, notebook_timeout=None, memory_limit=None, cache=False,
+                  warm_kernels=False, max_uses=50, compactor=None):
+        '''
+        Executes the pending jobs of a RunQueue, highest priority first, until
+        the queue is empty or limit candidates have been run. Candidates that
+        are not in the queue yet are added with priority 0.
+        '''
+        if queue is None:
+            queue = RunQueue(queue_path(self.shard, self.notebook_name))
+        queue.enqueue(list(self.notebooks))
+        execution_cache = ExecutionCache() if cache else None
+        settings = ExecutionSettings(kernel, save_originals, cell_timeout, notebook_timeout, memory_limit,
+                                     execution_cache, warm_kernels, max_uses, compactor)
+        run_log = self.run_log()
+        profile_log = self.profile_log()
+        candidates = set(self.notebooks)
+        started = 0
+        running = set()
+
+        with ProcessPoolExecutor(max_workers=workers) as pool, tqdm(total=limit) as progress:
+            while True:
+                free_slots = workers - len(running)
+                if limit is not None:
+                    free_slots = min(free_slots, limit - started)
+                for auth in queue.claim(free_slots, candidates) if free_slots > 0 else []:
+                    running.add(pool.submit(run_candidate, auth, self.candidate_dir(auth), self.notebook_name,
+                                            self.marking_content(auth), settings))
+                    started += 1
+
+                if len(running) == 0:
+                    next_available = queue.next_available(candidates)
+                    if next_available is None or (limit is not None and started >= limit):
+                        break
+                    # only jobs waiting for a retry are left
+                    time.sleep(max(0, next_available - time.time()))
+                    continue
+
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    auth, status, auth_errors, profile = future.result()
+                    run_log.append(auth, status, auth_errors)
+                    profile_log.append(auth, status, profile)
+                    queue.complete(auth, status, auth_errors)
+                    progress.update(1)
+
+        self.runs_results = run_log.export_csv(f'{self.scores_dir}/nbta_runs.csv')
+        self.queue_summary = queue.summary()
 
         return self
 
-    def run_single_notebook(self, auth, nb, save_originals, ep):
-        super_path = os.getcwd()
-        if save_originals is not None:
-            for original_file in save_originals:
-                try:
-                    shutil.copy(f'{self.base_dir}/{auth}/{original_file}', f'{self.base_dir}/{auth}/nbta_{original_file}')
-                except:
-                    pass
-        os.chdir(f'{super_path}/{self.base_dir}/{auth}')
-        notebook_filename_out = f'{self.notebook_name}_marking.ipynb'
+    def candidate_dir(self, auth):
+        return os.path.abspath(f'{self.base_dir}/{auth}')
 
-        try:
-            out = ep.preprocess(nb, {'metadata': {'path': ''}})
-        except CellExecutionError as e:
-            print(e)
-        finally:
-            with open(notebook_filename_out, mode='w', encoding='utf-8') as f:
-                nbf.write(nb, f)
-        auth_errors = []
-        passed = True
-        for cell in nb['cells']:
-            if cell['cell_type']=='code':
-                for output in cell['outputs']:
-                    if output['output_type'] == 'error':
-                        auth_errors.append(f"{output['ename']}: {output['evalue']}")
-                        passed = False
-
-        os.chdir(super_path)
-        return passed, auth_errors
+    def run_single_notebook(self, auth, nb, save_originals, ep, cache=None, compactor=None):
+        return execute_marking_notebook(self.candidate_dir(auth), self.notebook_name, nb, ep, save_originals, cache,
+                                        compactor)
 
     def generate_question_notebooks(self):
+        '''
+        Writes <question>_all_answers.ipynb for every question, with the
+        answers of all candidates. Each notebook is split into all its answers
+        in one pass and appended to the question notebooks straight away, so
+        in lazy mode memory use does not grow with the cohort.
+        '''
         questions = self.questions
-        for index,question in enumerate(questions):
-            if index+1 != len(questions):
-                next_question = questions[index+1]
-            else:
-                next_question = None
-
-            cells = []
-            for auth, notebook in self.notebooks.items():
-                cells = cells + notebook.yield_question_cells(question,next_question)
-                  
-            question_notebook = nbf.v4.new_notebook()    
-            question_notebook['cells'] = cells
-
-            with open(f'{question.name}_all_answers.ipynb', 'w') as f:
-                nbf.write(question_notebook,f)
-
+        tag_index = TagIndex(questions)
+        writers = [NotebookStreamWriter(f'{question.name}_all_answers.ipynb') for question in questions]
+        try:
+            for auth, notebook in tqdm(self.iter_notebooks(), total=len(self.candidates)):
+                for writer, cells in zip(writers, notebook.question_segments(questions, tag_index)):
+                    writer.write_cells(cells)
+        finally:
+            for writer in writers:
+                writer.close()
 
 
 if __name__ == '__main__':
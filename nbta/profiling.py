@@ -0,0 +1,65 @@
+import pandas as pd
+from nbta.runlog import RunLog
+
+CANDIDATE_COLUMNS = ['candidate', 'status', 'kernel_startup', 'duration', 'peak_memory', 'student_time', 'grader_time']
+CELL_COLUMNS = ['candidate', 'index', 'role', 'name', 'duration']
+
+
+class ProfileLog(RunLog):
+    '''
+    Usage: ProfileLog(path='grading/scores/nbta_profile.jsonl')
+
+    Timings of every notebook run, kept next to the run log: kernel start-up
+    time, total wall time and peak kernel memory (MB) of each candidate, and
+    the wall time of every code cell. Cells inserted by nbta have the role
+    'grader', the candidate's own cells the role 'student'. report() points at
+    the slowest cells and candidates.
+    '''
+
+    def __init__(self, path='grading/scores/nbta_profile.jsonl'):
+        super().__init__(path)
+
+    def append(self, candidate, status, profile):
+        if profile is None or profile.get('cached', False):
+            return None
+        return super().append(candidate, status, None, **profile)
+
+    def cells(self):
+        rows = [{'candidate': candidate, **cell}
+                for candidate, record in self.latest().items() for cell in record.get('cells', [])]
+        return pd.DataFrame(data=rows, columns=CELL_COLUMNS)
+
+    def candidate_times(self):
+        cells = self.cells()
+        by_role = cells.pivot_table(index='candidate', columns='role', values='duration', aggfunc='sum')
+        by_role = by_role.reindex(columns=['student', 'grader'], fill_value=0).fillna(0)
+        table = self.load()
+        for column in CANDIDATE_COLUMNS[:5]:
+            if column not in table.columns:
+                table[column] = None
+        table = table[CANDIDATE_COLUMNS[:5]].set_index('candidate')
+        table['student_time'] = by_role['student']
+        table['grader_time'] = by_role['grader']
+        return table.reset_index()
+
+    def report(self, top=10, verbose=True):
+        '''
+        Returns the slowest cells, the slowest candidates and the time spent
+        per role (student or grader code), per cell and in total.
+        '''
+        cells = self.cells()
+        candidates = self.candidate_times()
+        roles = cells.groupby('role').duration.agg(['count', 'sum', 'mean', 'median', 'max'])
+        roles = roles.reindex(['student', 'grader'])
+        grader_cells = cells[cells.role == 'grader'].groupby('name').duration.agg(['count', 'mean', 'max'])
+        report = {'slowest_cells': cells.sort_values('duration', ascending=False).head(top).reset_index(drop=True),
+                  'slowest_candidates': candidates.sort_values('duration', ascending=False).head(top).reset_index(drop=True),
+                  'time_by_role': roles,
+                  'grader_cells': grader_cells.sort_values('mean', ascending=False),
+                  'kernel_startup': candidates.kernel_startup.astype(float).describe()}
+        if verbose:
+            for name, table in report.items():
+                print(f'--- {name.replace("_", " ")} ---')
+                print(table.to_string())
+                print()
+        return report
@@ -0,0 +1,102 @@
+import pandas as pd
+import json
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+RUN_COLUMNS = ['candidate', 'status', 'message', 'time']
+
+
+class RunLog():
+    '''
+    Usage: RunLog(path='grading/scores/nbta_runs.jsonl')
+
+    Append-only log of notebook runs, one JSON record per line. Every record is
+    written with a single locked append, so several worker processes (or
+    several marking sessions) can write to the same log at once. When a
+    candidate was run more than once, the latest record wins.
+    '''
+
+    def __init__(self, path='grading/scores/nbta_runs.jsonl'):
+        self.path = path
+        folder = os.path.dirname(self.path)
+        if folder != '' and not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+
+    def append(self, candidate, status, message, **extra):
+        record = {'candidate': candidate, 'status': status, 'message': message, 'time': time.time()}
+        record.update(extra)
+        self.write_line(self.to_line(record))
+        return record
+
+    @staticmethod
+    def to_line(record):
+        return json.dumps(record, default=str) + '\n'
+
+    def write_line(self, line):
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            os.write(fd, line.encode('utf-8'))
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def records(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # a record interrupted half-way through a write
+                    continue
+
+    def latest(self):
+        latest_records = {}
+        for record in self.records():
+            latest_records[record['candidate']] = record
+        return latest_records
+
+    def load(self, history=False):
+        if history:
+            data = list(self.records())
+        else:
+            data = list(self.latest().values())
+        table = pd.DataFrame(data=data)
+        for column in RUN_COLUMNS:
+            if column not in table.columns:
+                table[column] = None
+        return table
+
+    def candidates(self):
+        return set(self.latest().keys())
+
+    def summary(self):
+        return self.load()['status'].value_counts()
+
+    def import_csv(self, path='grading/scores/nbta_runs.csv'):
+        '''
+        Imports the runs recorded by older versions of nbta in nbta_runs.csv.
+        Nothing is imported if the log already exists.
+        '''
+        if os.path.exists(self.path) or not os.path.exists(path):
+            return self
+        runs = pd.read_csv(path)
+        lines = [self.to_line({'candidate': row['candidate'], 'status': row['status'],
+                               'message': row['message'], 'time': None})
+                 for row in runs.to_dict('records')]
+        self.write_line(''.join(lines))
+        return self
+
+    def export_csv(self, path='grading/scores/nbta_runs.csv'):
+        table = self.load()
+        table[['candidate', 'status', 'message']].to_csv(path, index=False)
+        return table
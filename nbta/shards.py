@@ -0,0 +1,144 @@
+import pandas as pd
+import glob
+import hashlib
+import os
+from nbta.runlog import RunLog
+from nbta.jobs import RunQueue
+
+SCORES_DIR = 'grading/scores'
+LOG_NAMES = ['nbta_runs.jsonl', 'nbta_profile.jsonl']
+QUEUE_PREFIX = 'nbta_queue'
+
+
+def parse_shard(shard):
+    '''
+    Usage: parse_shard('2/4') -> (2, 4)
+
+    Accepts 'i/N' strings or (i, N) tuples. Shards are numbered from 1 to N.
+    '''
+    if shard is None:
+        return None
+    if isinstance(shard, str):
+        try:
+            index, count = [int(part) for part in shard.split('/')]
+        except ValueError:
+            raise ValueError(f"Shard must be written as 'i/N', got {shard!r}")
+    else:
+        index, count = shard
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f'Shard {index}/{count} is out of range: use 1 <= i <= N')
+    return index, count
+
+
+def shard_of(candidate, count):
+    '''
+    Shard (1 to count) a candidate belongs to. The split only depends on the
+    candidate name, so every machine computes the same one and adding a
+    candidate never moves the others.
+    '''
+    digest = hashlib.md5(candidate.encode('utf-8')).hexdigest()
+    return int(digest, 16) % count + 1
+
+
+def in_shard(candidates, shard):
+    shard = parse_shard(shard)
+    if shard is None:
+        return list(candidates)
+    index, count = shard
+    return [candidate for candidate in candidates if shard_of(candidate, count) == index]
+
+
+def shard_dir(shard, scores_dir=SCORES_DIR):
+    '''
+    Folder holding the run log and autotest scores of one shard, or
+    scores_dir itself when shard is None.
+    '''
+    shard = parse_shard(shard)
+    if shard is None:
+        return scores_dir
+    index, count = shard
+    return f'{scores_dir}/shards/{index}-of-{count}'
+
+
+def merge_logs(path, shard_paths):
+    '''
+    Appends to the log at path the latest record of every candidate found in
+    the shard logs, skipping records it already holds.
+    '''
+    records = {}
+    for shard_path in shard_paths:
+        for candidate, record in RunLog(shard_path).latest().items():
+            # a candidate run by two different splits keeps its latest run
+            if candidate not in records or (record['time'] or 0) >= (records[candidate]['time'] or 0):
+                records[candidate] = record
+    log = RunLog(path)
+    previous = log.latest()
+    new_records = [record for candidate, record in records.items() if previous.get(candidate) != record]
+    if len(new_records) > 0:
+        log.write_line(''.join(RunLog.to_line(record) for record in new_records))
+    return records
+
+
+def merge_shards(scores_dir=SCORES_DIR):
+    '''
+    Combines the outputs written by every shard under <scores_dir>/shards into
+    the files a single-machine run would have written: the run log (and
+    nbta_runs.csv), the execution profiles and one csv per autotest and autotest report. Returns the
+    merged run log as a DataFrame.
+    '''
+    shard_dirs = sorted(glob.glob(f'{scores_dir}/shards/*-of-*'))
+    if len(shard_dirs) == 0:
+        print(f'No shard outputs found in {scores_dir}/shards')
+        return None
+
+    counts = {os.path.basename(folder).split('-of-')[1] for folder in shard_dirs}
+    if len(counts) > 1:
+        print(f'Warning: merging shards of different splits ({", ".join(sorted(counts))} shards)')
+
+    merged_logs = {log_name: merge_logs(f'{scores_dir}/{log_name}', [f'{folder}/{log_name}' for folder in shard_dirs])
+                   for log_name in LOG_NAMES}
+    records = merged_logs['nbta_runs.jsonl']
+    runs = RunLog(f'{scores_dir}/nbta_runs.jsonl').export_csv(f'{scores_dir}/nbta_runs.csv')
+
+    file_names = sorted({os.path.basename(path) for folder in shard_dirs for path in glob.glob(f'{folder}/*.csv')})
+    for file_name in file_names:
+        if file_name == 'nbta_runs.csv':
+            continue
+        tables = [pd.read_csv(f'{folder}/{file_name}') for folder in shard_dirs
+                  if os.path.exists(f'{folder}/{file_name}')]
+        merged = pd.concat(tables, ignore_index=True)
+        if 'candidate' in merged.columns:
+            merged = merged.drop_duplicates(subset='candidate', keep='last')
+        merged.to_csv(f'{scores_dir}/{file_name}', index=False)
+
+    print(f'Merged {len(shard_dirs)} shard(s): {len(records)} runs and {len(file_names)} score file(s)')
+    return runs
+
+
+def queue_path(shard, notebook_name, scores_dir=SCORES_DIR):
+    '''
+    Default run queue of a notebook in a shard. Every notebook has its own
+    queue, so the jobs of one assignment never hide those of the next one,
+    and every shard has its own queue, as SQLite locking is not reliable on
+    network filesystems shared by several servers.
+    '''
+    return f'{shard_dir(shard, scores_dir)}/{QUEUE_PREFIX}_{notebook_name}.sqlite'
+
+
+def queue_summary(scores_dir=SCORES_DIR):
+    '''
+    Number of jobs in each state for every queue of scores_dir and of its
+    shards, one column per queue, plus a total when there are several.
+    '''
+    paths = {}
+    for path in sorted(glob.glob(f'{scores_dir}/{QUEUE_PREFIX}*.sqlite')
+                       + glob.glob(f'{scores_dir}/shards/*-of-*/{QUEUE_PREFIX}*.sqlite')):
+        name = os.path.basename(path)[len(QUEUE_PREFIX):-len('.sqlite')].lstrip('_') or 'queue'
+        folder = os.path.dirname(path)
+        if folder != scores_dir:
+            name = f'{name} {os.path.basename(folder)}'
+        paths[name] = path
+    table = pd.DataFrame({name: RunQueue(path).summary() for name, path in paths.items()})
+    if table.shape[1] > 1:
+        table['total'] = table.sum(axis=1)
+    return table
@@ -0,0 +1,165 @@
+import pandas as pd
+import json
+import os
+import sqlite3
+
+STORE_PATH = 'grading/nbta_grades.sqlite'
+
+TABLES = ['CREATE TABLE IF NOT EXISTS selections (candidate TEXT, question TEXT, options TEXT, '
+          'PRIMARY KEY (candidate, question))',
+          'CREATE TABLE IF NOT EXISTS feedbacks (candidate TEXT, question TEXT, kind TEXT, text TEXT, '
+          'PRIMARY KEY (candidate, question, kind))',
+          'CREATE TABLE IF NOT EXISTS scores (candidate TEXT, test TEXT, data TEXT, '
+          'PRIMARY KEY (candidate, test))',
+          'CREATE TABLE IF NOT EXISTS markers (candidate TEXT PRIMARY KEY, marker TEXT)']
+
+
+def to_builtin(value):
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+class GradeStore():
+    '''
+    Usage: GradeStore(path='grading/nbta_grades.sqlite')
+
+    Single SQLite database holding the selections, feedbacks, autotest scores
+    and first markers of the whole cohort. The store is opt-in: creating it
+    (GradeStore() from the course root, or import_grades to bring in existing
+    grades/ folders) makes the marking widgets write to it and the graders
+    query it, instead of one small file per candidate and question in each
+    candidate's grades/ folder. Graders still read the grades/ files of
+    candidates missing from the store.
+    '''
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        for table in TABLES:
+            self.execute(table)
+
+    @classmethod
+    def find(cls, base_dir='.'):
+        '''
+        Returns the store of the course rooted at base_dir, or None when it
+        has not been created. Widgets call it with base_dir='../..'.
+        '''
+        if not cls.exists(f'{base_dir}/{STORE_PATH}'):
+            return None
+        return cls(f'{base_dir}/{STORE_PATH}')
+
+    @staticmethod
+    def exists(path=STORE_PATH):
+        return os.path.exists(path)
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def execute(self, query, rows=None):
+        connection = self.connect()
+        try:
+            with connection:
+                if rows is None:
+                    connection.execute(query)
+                else:
+                    connection.executemany(query, rows)
+        finally:
+            connection.close()
+
+    def query(self, query, params=()):
+        connection = self.connect()
+        try:
+            return pd.read_sql_query(query, connection, params=params)
+        finally:
+            connection.close()
+
+    def save_selection(self, candidate, question, options):
+        options = json.dumps([str(option) for option in options])
+        self.execute('INSERT OR REPLACE INTO selections VALUES (?, ?, ?)', [(candidate, question, options)])
+
+    def load_selection(self, candidate, question):
+        found = self.query('SELECT options FROM selections WHERE candidate = ? AND question = ?',
+                           (candidate, question))
+        if found.shape[0] == 0:
+            return None
+        return json.loads(found.options.values[0])
+
+    def selections(self, question):
+        '''
+        Long table (candidate, option) of every option selected for question.
+        Candidates that saved an empty selection have no rows; saved_candidates
+        lists everyone who saved.
+        '''
+        found = self.query('SELECT candidate, options FROM selections WHERE question = ?', (question,))
+        found['option'] = found.options.apply(json.loads)
+        return found.explode('option').dropna(subset=['option'])[['candidate', 'option']]
+
+    def saved_candidates(self, question):
+        return set(self.query('SELECT candidate FROM selections WHERE question = ?', (question,)).candidate)
+
+    def save_feedback(self, candidate, question, kind, text):
+        self.execute('INSERT OR REPLACE INTO feedbacks VALUES (?, ?, ?, ?)', [(candidate, question, kind, text)])
+
+    def load_feedback(self, candidate, question, kind):
+        found = self.query('SELECT text FROM feedbacks WHERE candidate = ? AND question = ? AND kind = ?',
+                           (candidate, question, kind))
+        if found.shape[0] == 0:
+            return None
+        return found.text.values[0]
+
+    def feedbacks(self, question):
+        return self.query('SELECT candidate, kind, text FROM feedbacks WHERE question = ?', (question,))
+
+    def save_scores(self, candidate, test, scores):
+        self.execute('INSERT OR REPLACE INTO scores VALUES (?, ?, ?)',
+                     [(candidate, test, json.dumps(scores, default=to_builtin))])
+
+    def scores(self, test):
+        found = self.query('SELECT candidate, data FROM scores WHERE test = ?', (test,))
+        data = [{**json.loads(row_data), 'candidate': candidate} for candidate, row_data in found.values]
+        return pd.DataFrame(data=data)
+
+    def save_marker(self, candidate, marker):
+        self.execute('INSERT OR REPLACE INTO markers VALUES (?, ?)', [(candidate, marker)])
+
+    def markers(self):
+        return self.query('SELECT candidate, marker FROM markers')
+
+    def import_grades(self, folder, candidates=None):
+        '''
+        Imports the files written by earlier versions of nbta in
+        <folder>/<candidate>/grades into the store.
+        '''
+        if candidates is None:
+            candidates = [c for c in os.listdir(folder) if os.path.isdir(f'{folder}/{c}/grades')]
+        selections, feedbacks, scores, markers = [], [], [], []
+
+        for candidate in candidates:
+            base_dir = f'{folder}/{candidate}/grades'
+            if not os.path.isdir(base_dir):
+                continue
+            for file_name in os.listdir(base_dir):
+                path = f'{base_dir}/{file_name}'
+                try:
+                    if file_name.startswith('nbta_selection_') and file_name.endswith('.csv'):
+                        options = pd.read_csv(path)['options'].astype(str).tolist()
+                        selections.append((candidate, file_name[len('nbta_selection_'):-len('.csv')], json.dumps(options)))
+                    elif file_name.startswith('nbta_pos_feedback_') or file_name.startswith('nbta_neg_feedback_'):
+                        with open(path) as f:
+                            text = f.read()
+                        feedbacks.append((candidate, file_name[len('nbta_pos_feedback_'):-len('.txt')], file_name[5:8], text))
+                    elif file_name.startswith('nbta_score_') and file_name.endswith('.csv'):
+                        row = pd.read_csv(path).iloc[0].to_dict()
+                        scores.append((candidate, file_name[len('nbta_score_'):-len('.csv')], json.dumps(row, default=to_builtin)))
+                    elif file_name == 'first_marker.csv':
+                        markers.append((candidate, str(pd.read_csv(path).values[0][0])))
+                except Exception as e:
+                    print(f'Unable to import {path}: {e}')
+
+        self.execute('INSERT OR REPLACE INTO selections VALUES (?, ?, ?)', selections)
+        self.execute('INSERT OR REPLACE INTO feedbacks VALUES (?, ?, ?, ?)', feedbacks)
+        self.execute('INSERT OR REPLACE INTO scores VALUES (?, ?, ?)', scores)
+        self.execute('INSERT OR REPLACE INTO markers VALUES (?, ?)', markers)
+        print(f'Imported {len(selections)} selections, {len(feedbacks)} feedbacks, '
+              f'{len(scores)} scores and {len(markers)} markers')
+        return self
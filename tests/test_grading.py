@@ -0,0 +1,75 @@
+import numpy as np
+import os
+import pandas as pd
+import pytest
+from nbta.grading import GradingSchema
+
+OPTIONS = ['not_answered', 'pass', 'merit', 'distinction', 'neg_no_comments', 'neg_no_plots', 'good_names']
+
+
+@pytest.fixture
+def course(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('grading/testing/notebook_tests')
+    options = pd.DataFrame({'options': OPTIONS + ['additional_comments'],
+                            'feedback': [f'feedback for {o}' for o in OPTIONS] + ['comments'],
+                            'points': list(range(len(OPTIONS))) + [0]})
+    options.to_csv('grading/testing/notebook_tests/Q1.csv', index=False)
+    return tmp_path
+
+
+def old_markings(folder, candidates, question_cols):
+    # GradingSchema.load_marks before the single crosstab
+    marking = pd.DataFrame(data=[], columns=['candidate'] + list(question_cols))
+    for candidate in candidates:
+        marking.loc[marking.shape[0]] = [candidate] + [False for _ in question_cols]
+        try:
+            values = pd.read_csv(f'{folder}/{candidate}/grades/nbta_selection_Q1.csv')['options'].values
+            marking.loc[marking[marking.candidate == candidate].index, values] = True
+        except Exception:
+            pass
+    for bool_question in question_cols:
+        marking[bool_question] = marking[bool_question].astype(bool)
+    return marking
+
+
+def test_option_matrix_matches_row_by_row_loading(course):
+    rng = np.random.default_rng(0)
+    question_cols = pd.read_csv('grading/testing/notebook_tests/Q1.csv').options.values
+    candidates = [f'candidate_{i}' for i in range(40)]
+    for candidate in candidates[:-5]:
+        os.makedirs(f'notebooks/{candidate}/grades')
+        selected = rng.choice(question_cols, rng.integers(0, 4), replace=False)
+        pd.Series(selected, name='options', dtype=object).to_csv(
+            f'notebooks/{candidate}/grades/nbta_selection_Q1.csv', index=False)
+
+    schema = GradingSchema('Q1', 10).load_marks('notebooks', candidates)
+    expected = old_markings('notebooks', candidates, question_cols)
+    pd.testing.assert_frame_equal(schema.markings, expected, check_dtype=False)
+    assert sorted(schema.load_report.candidate) == candidates[-5:]
+
+
+def test_option_matrix_reports_unknown_options(course):
+    question_cols = pd.read_csv('grading/testing/notebook_tests/Q1.csv').options.values
+    schema = GradingSchema('Q1', 10)
+    failures = []
+    selections = [pd.DataFrame({'candidate': ['a', 'a'], 'option': ['pass', 'bogus']})]
+    marking = schema.option_matrix(selections, ['a', 'b'], question_cols, failures)
+    assert failures == [{'candidate': 'a', 'error': 'Unknown option: bogus'}]
+    assert marking.set_index('candidate').loc['a', 'pass']
+    assert not marking.set_index('candidate').loc['b'].any()
+
+
+def test_vectorised_feedback_matches_row_by_row(course):
+    rng = np.random.default_rng(1)
+    nb_candidates = 200
+    markings = pd.DataFrame(rng.random((nb_candidates, len(OPTIONS))) > 0.5, columns=OPTIONS)
+    markings['not_answered'] = rng.random(nb_candidates) > 0.9
+    markings['additional_comments'] = rng.choice(['', ' ', 'well done', 'see Q2'], nb_candidates)
+    markings.insert(0, 'candidate', [f'candidate_{i}' for i in range(nb_candidates)])
+
+    schema = GradingSchema('Q1', 20)
+    schema.markings = markings
+    expected = schema.get_feedback(vectorized=False)
+    feedbacks = schema.get_feedback(vectorized=True)
+    pd.testing.assert_frame_equal(feedbacks, expected)
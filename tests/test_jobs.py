@@ -0,0 +1,90 @@
+import sqlite3
+import time
+from nbta.jobs import RunQueue, session_name
+
+
+def states(queue):
+    return dict(queue.load()[['candidate', 'state']].values)
+
+
+def test_enqueue_keeps_existing_jobs_unless_reset(tmp_path):
+    queue = RunQueue(str(tmp_path / 'queue.sqlite'))
+    queue.enqueue(['a', 'b'])
+    queue.complete(queue.claim(1)[0], 'ok', [])
+    queue.enqueue(['a', 'b', 'c'])
+    assert states(queue) == {'a': 'done', 'b': 'pending', 'c': 'pending'}
+    queue.enqueue(['a'], priority=3, reset=True)
+    assert states(queue)['a'] == 'pending'
+
+
+def test_claim_by_priority(tmp_path):
+    queue = RunQueue(str(tmp_path / 'queue.sqlite'))
+    queue.enqueue(['a', 'b'])
+    queue.enqueue(['c'], priority=5)
+    assert queue.claim(2) == ['c', 'a']
+    assert queue.claim(5, candidates={'a', 'c'}) == []
+    assert queue.claim(5) == ['b']
+    assert set(states(queue).values()) == {'running'}
+    assert set(queue.load().owner) == {session_name()}
+
+
+def test_complete_states(tmp_path):
+    queue = RunQueue(str(tmp_path / 'queue.sqlite'), max_retries=1, backoff=60)
+    queue.enqueue(['ok', 'error', 'timeout', 'kernel'])
+    queue.claim(4)
+    assert queue.complete('ok', 'ok', []) == 'done'
+    assert queue.complete('error', 'error', ['ValueError: x']) == 'done'
+    assert queue.complete('timeout', 'timeout', []) == 'failed'
+    assert queue.complete('kernel', 'kernel_error', []) == 'pending'
+
+
+def test_kernel_errors_retry_with_backoff(tmp_path):
+    queue = RunQueue(str(tmp_path / 'queue.sqlite'), max_retries=1, backoff=60)
+    queue.enqueue(['a'])
+    queue.claim(1)
+    queue.complete('a', 'kernel_error', [])
+    # waiting for its retry
+    assert queue.claim(1) == []
+    assert queue.next_available() > time.time() + 50
+
+    queue.execute("UPDATE jobs SET available_at = 0")
+    assert queue.claim(1) == ['a']
+    assert queue.complete('a', 'kernel_error', []) == 'failed'
+
+
+def test_requeue(tmp_path):
+    queue = RunQueue(str(tmp_path / 'queue.sqlite'))
+    queue.enqueue(['a', 'b'])
+    queue.claim(2)
+    queue.complete('a', 'timeout', [])
+    queue.complete('b', 'ok', [])
+    queue.requeue(['failed'], priority=10)
+    jobs = queue.load().set_index('candidate')
+    assert jobs.loc['a', 'state'] == 'pending' and jobs.loc['a', 'priority'] == 10
+    assert jobs.loc['a', 'attempts'] == 0
+    assert jobs.loc['b', 'state'] == 'done'
+
+
+def test_recover_only_dead_or_old_sessions(tmp_path):
+    queue = RunQueue(str(tmp_path / 'queue.sqlite'))
+    queue.enqueue(['live', 'dead', 'old', 'other'])
+    queue.claim(4)
+    dead = f"{session_name().rpartition(':')[0]}:999999999"
+    queue.execute("UPDATE jobs SET owner = ? WHERE candidate = ?", [(dead, 'dead')])
+    queue.execute("UPDATE jobs SET owner = 'another-host:1', updated = 0 WHERE candidate = 'old'")
+    queue.execute("UPDATE jobs SET owner = 'another-host:1' WHERE candidate = 'other'")
+
+    assert sorted(queue.recover(3600, candidates={'live', 'dead', 'old'})) == ['dead', 'old']
+    assert states(queue) == {'live': 'running', 'dead': 'pending', 'old': 'pending', 'other': 'running'}
+
+
+def test_queue_without_owner_column_is_upgraded(tmp_path):
+    path = str(tmp_path / 'queue.sqlite')
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE jobs (candidate TEXT PRIMARY KEY, state TEXT, priority INTEGER, '
+                       'attempts INTEGER, available_at REAL, status TEXT, message TEXT, updated REAL)')
+    connection.commit()
+    connection.close()
+    queue = RunQueue(path).enqueue(['a'])
+    assert queue.claim(1) == ['a']
+    assert 'owner' in queue.load().columns
@@ -0,0 +1,53 @@
+import os
+import pandas as pd
+import pytest
+from nbta.runlog import RunLog
+from nbta.shards import in_shard, merge_shards, parse_shard, shard_dir, shard_of
+
+
+def test_parse_shard():
+    assert parse_shard('2/4') == (2, 4)
+    assert parse_shard((1, 1)) == (1, 1)
+    assert parse_shard(None) is None
+    for shard in ['0/4', '5/4', '1-4', 'a/b']:
+        with pytest.raises(ValueError):
+            parse_shard(shard)
+
+
+def test_shards_split_the_cohort():
+    candidates = [f'candidate_{i}' for i in range(500)]
+    shards = [in_shard(candidates, (index, 4)) for index in range(1, 5)]
+    assert sorted(c for shard in shards for c in shard) == sorted(candidates)
+    assert all(len(shard) > 50 for shard in shards)
+    assert in_shard(candidates, None) == candidates
+
+
+def test_shard_of_only_depends_on_the_name():
+    assert shard_of('candidate_7', 3) == shard_of('candidate_7', 3)
+    assert in_shard(['candidate_7'], (shard_of('candidate_7', 3), 3)) == ['candidate_7']
+    # adding candidates does not move the others
+    before = in_shard([f'c{i}' for i in range(50)], '1/3')
+    after = in_shard([f'c{i}' for i in range(100)], '1/3')
+    assert after[:len(before)] == before
+
+
+def test_merge_shards(tmp_path):
+    scores_dir = str(tmp_path / 'scores')
+    for shard, candidates in [('1/2', ['a', 'b']), ('2/2', ['c'])]:
+        folder = shard_dir(shard, scores_dir)
+        os.makedirs(folder)
+        log = RunLog(f'{folder}/nbta_runs.jsonl')
+        for candidate in candidates:
+            log.append(candidate, 'ok', [])
+        pd.DataFrame({'score': [1] * len(candidates), 'candidate': candidates}).to_csv(f'{folder}/size_test.csv',
+                                                                                       index=False)
+    # a candidate run again by the second shard keeps its latest run
+    RunLog(f'{shard_dir("2/2", scores_dir)}/nbta_runs.jsonl').append('a', 'error', ['ValueError: x'])
+
+    runs = merge_shards(scores_dir)
+    assert dict(runs[['candidate', 'status']].values) == {'a': 'error', 'b': 'ok', 'c': 'ok'}
+    assert sorted(pd.read_csv(f'{scores_dir}/size_test.csv').candidate) == ['a', 'b', 'c']
+
+    # merging again does not duplicate the records
+    merge_shards(scores_dir)
+    assert len(list(RunLog(f'{scores_dir}/nbta_runs.jsonl').records())) == 3
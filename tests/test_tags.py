@@ -0,0 +1,100 @@
+import nbformat as nbf
+import numpy as np
+import pytest
+from nbta.notebooks import ParsedNotebook, TagIndex
+
+
+class Question():
+    def __init__(self, name, tag, position='before'):
+        self.name = name
+        self.tag = tag
+        self.position = position
+        self.cell = nbf.v4.new_code_cell(source=f"nbta_test_{name} = QuestionGrader('{name}')")
+
+
+def naive_matches(new_cells, source):
+    return [new_cell for new_cell in new_cells if new_cell.tag in source]
+
+
+def write_notebook(path, sources):
+    nb = nbf.v4.new_notebook()
+    nb.cells = [nbf.v4.new_markdown_cell(source) for source in sources]
+    nbf.write(nb, str(path))
+    return ParsedNotebook(str(path), 'candidate_1', 'hw_marking')
+
+
+def old_segment(notebook, start_question, end_question):
+    # yield_question_cells before the single-pass split, without its two bugs
+    return_cells = []
+    in_scope = False
+    for this_cell in notebook.content['cells']:
+        started = start_question.tag in this_cell['source']
+        if started:
+            in_scope = True
+            return_cells.append(this_cell)
+        if end_question is not None and end_question.tag in this_cell['source']:
+            return return_cells
+        if in_scope and not started:
+            return_cells.append(this_cell)
+    return return_cells
+
+
+@pytest.mark.parametrize('source, expected', [
+    ('## Q1\nsome text', ['Q1']),
+    ('# Q10 is not # Q1', ['Q1', 'Q10']),
+    ('# Q10', ['Q1', 'Q10']),
+    ('no tag here', []),
+    ('# Q2 # Q2 # Q1', ['Q1', 'Q2']),
+])
+def test_tag_index_contained_tags(source, expected):
+    questions = [Question('Q1', '# Q1'), Question('Q2', '# Q2'), Question('Q10', '# Q10')]
+    assert [q.name for q in TagIndex(questions).matches(source)] == expected
+
+
+def test_tag_index_overlapping_tags():
+    questions = [Question('a', 'aba'), Question('b', 'bab'), Question('c', 'ab')]
+    assert [q.name for q in TagIndex(questions).matches('xabab')] == ['a', 'b', 'c']
+
+
+def test_tag_index_duplicate_tags_keep_order():
+    questions = [Question('after', '# Q1', 'after'), Question('before', '# Q1'), Question('other', '# Q2')]
+    assert [q.name for q in TagIndex(questions).matches('# Q1')] == ['after', 'before']
+
+
+def test_tag_index_without_questions():
+    assert TagIndex([]).matches('# Q1') == []
+
+
+def test_tag_index_matches_naive_search():
+    rng = np.random.default_rng(0)
+    alphabet = list('#Q 12ab\n')
+    for _ in range(200):
+        tags = {''.join(rng.choice(alphabet, rng.integers(1, 5))) for _ in range(rng.integers(1, 8))}
+        questions = [Question(f'q{i}', tag) for i, tag in enumerate(sorted(tags))]
+        index = TagIndex(questions)
+        for _ in range(20):
+            source = ''.join(rng.choice(alphabet, rng.integers(0, 40)))
+            assert index.matches(source) == naive_matches(questions, source)
+
+
+def test_question_segments(tmp_path):
+    questions = [Question('Q1', '# Q1'), Question('Q2', '# Q2'), Question('Q3', '# Q3')]
+    notebook = write_notebook(tmp_path / 'hw.ipynb', ['intro', '# Q1', 'answer 1', '# Q2', 'answer 2', '# Q3', 'end'])
+    segments = notebook.question_segments(questions)
+    sources = [[cell['source'] for cell in segment] for segment in segments]
+    assert sources == [['ANSWER FROM: candidate_1', '# Q1', 'answer 1'],
+                       ['ANSWER FROM: candidate_1', '# Q2', 'answer 2'],
+                       ['ANSWER FROM: candidate_1', '# Q3', 'end']]
+
+
+def test_question_segments_match_question_by_question_split(tmp_path):
+    rng = np.random.default_rng(1)
+    questions = [Question(f'Q{i}', f'# Q{i}') for i in range(1, 12)]
+    choices = [q.tag for q in questions] + ['code', 'text', '# Q1 and # Q2', '']
+    for i in range(100):
+        sources = list(rng.choice(choices, rng.integers(0, 30)))
+        notebook = write_notebook(tmp_path / f'hw_{i}.ipynb', sources)
+        segments = notebook.question_segments(questions)
+        for index, question in enumerate(questions):
+            end_question = questions[index + 1] if index + 1 < len(questions) else None
+            assert segments[index][1:] == old_segment(notebook, question, end_question)